@@ -20,6 +20,25 @@
 """Module to contain the variable aliasing functionality."""
 
 
+class _Alias:
+  """A wrapper object used for providing a new name for a variable."""
+  __slots__ = ("_variable",)
+
+  def __init__(self, variable):
+    """Create a new alias for the given variable."""
+    self._variable = variable
+
+
+  def __enter__(self):
+    """The block enter handler just returns the variable."""
+    return self._variable
+
+
+  def __exit__(self, type_, value, traceback):
+    """The block exit handler does nothing."""
+    pass
+
+
 def alias(variable):
   """Provide an additional name for a variable temporarily.
 
@@ -30,18 +49,4 @@ def alias(variable):
       var.doSth()
       var.doSthElse()
   """
-  class _Alias:
-    """A wrapper object used for providing a new name for a variable.
-
-      Notes: We rely on Python's closures here to avoid creating a
-             separate member variable.
-    """
-    def __enter__(self):
-      """The block enter handler just returns the variable."""
-      return variable
-
-    def __exit__(self, type_, value, traceback):
-      """The block exit handler does nothing."""
-      pass
-
-  return _Alias()
+  return _Alias(variable)
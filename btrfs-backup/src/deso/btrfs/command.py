@@ -42,9 +42,9 @@ def create(subvolume):
   return [_BTRFS, "subvolume", "create", subvolume]
 
 
-def delete(subvolume):
-  """Retrieve the command to delete a btrfs subvolume."""
-  return [_BTRFS, "subvolume", "delete", subvolume]
+def delete(*subvolumes):
+  """Retrieve the command to delete one or more btrfs subvolumes."""
+  return [_BTRFS, "subvolume", "delete"] + list(subvolumes)
 
 
 def snapshot(source, destination, writable=False):
@@ -38,11 +38,7 @@ def _checkFileStringInSpring(commands):
   """Check if the given spring contains the "{file}" string."""
   # We explicitly check all commands in the spring because we allow
   # commands other than the first to contain the {file} string.
-  for command in commands:
-    if _checkFileStringInCommand(command):
-      return True
-
-  return False
+  return any(map(_checkFileStringInCommand, commands))
 
 
 def _checkFileStringInCommand(command):
@@ -50,10 +46,10 @@ def _checkFileStringInCommand(command):
   # There are different ways the {file} string can be provided which
   # depend on the command used. It might be part of a short option, a
   # long option, or it can be a stand alone argument. We do not care
-  # as long as it does exist and so just create a string out of the
-  # respective filter command and scan it instead of inspecting every
-  # single argument of the command.
-  return "{file}" in " ".join(command)
+  # as long as it does exist in any argument. The search stops at the
+  # first argument containing it, without building a joined string of
+  # the entire command first.
+  return any("{file}" in arg for arg in command)
 
 
 def checkFileString(command):
@@ -79,7 +75,7 @@ def _replaceFileStringInSpring(commands, files):
   # in the first command of the spring. Not sure about use cases where
   # it would not be there but we leave that open to users.
   for i, command in enumerate(commands):
-    if "{file}" in " ".join(command):
+    if _checkFileStringInCommand(command):
       # For a spring we replicate the entire command containing the
       # '{file}' string (as opposed to the option associated with it, if
       # any) and insert a duplicate into the list of commands.
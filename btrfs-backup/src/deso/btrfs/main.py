@@ -53,6 +53,21 @@ from argparse import (
 )
 
 
+# The units a duration string may end in.
+_DURATION_SUFFIXES = {
+  "S": timedelta(seconds=1),
+  "M": timedelta(minutes=1),
+  "H": timedelta(hours=1),
+  "d": timedelta(days=1),
+  "w": timedelta(weeks=1),
+  "m": timedelta(weeks=4),
+  "y": timedelta(weeks=52),
+}
+# A duration string is a positive amount followed by one of the units.
+_DURATION_REGEX = regex(r"^([1-9][0-9]*)([{s}])$"
+                        .format(s="".join(_DURATION_SUFFIXES.keys())))
+
+
 def name():
   """Retrieve the name of the program."""
   return "btrfs-backup"
@@ -99,24 +114,27 @@ def run(method, subvolumes, src_repo, dst_repo, debug=False, **kwargs):
 
 def duration(string):
   """Create a timedelta object from a duration string."""
-  suffixes = {
-    "S": timedelta(seconds=1),
-    "M": timedelta(minutes=1),
-    "H": timedelta(hours=1),
-    "d": timedelta(days=1),
-    "w": timedelta(weeks=1),
-    "m": timedelta(weeks=4),
-    "y": timedelta(weeks=52),
-  }
-
-  for suffix, duration_ in suffixes.items():
-    expression = regex(r"^([1-9][0-9]*){s}$".format(s=suffix))
-    m = expression.match(string)
-    if m:
-      amount, = m.groups()
-      return int(amount) * duration_
-
-  raise ArgumentTypeError("Invalid duration string: \"%s\"." % string)
+  # A single expression covers all suffixes. The matched one selects
+  # the unit to multiply the amount with.
+  m = _DURATION_REGEX.match(string)
+  if not m:
+    raise ArgumentTypeError("Invalid duration string: \"%s\"." % string)
+
+  amount, suffix = m.groups()
+  return int(amount) * _DURATION_SUFFIXES[suffix]
+
+
+def jobs(string):
+  """Create a job count from a string."""
+  try:
+    count = int(string)
+  except ValueError:
+    count = 0
+
+  if count <= 0:
+    raise ArgumentTypeError("Invalid job count: \"%s\"." % string)
+
+  return count
 
 
 def checkSnapshotExtension(string):
@@ -320,6 +338,14 @@ def addBackupParser(parser):
          "suffixes are: S (seconds), M (minutes), H (hours), d (days), "
          "w (weeks), m (months), and y (years).",
   )
+  optional.add_argument(
+    "--jobs", action="store", type=jobs, metavar="count",
+    dest="jobs", default=1,
+    help="The maximum number of subvolumes to backup concurrently. By "
+         "default subvolumes are backed up one after the other. Note "
+         "that filters interacting with the user (e.g., by prompting "
+         "for a password) should not be used with more than one job.",
+  )
   addOptionalArgs(optional, backup=True)
   addStandardArgs(optional)
 
@@ -37,7 +37,7 @@ class Program:
 
 
   def backup(self, send_filters=None, recv_filters=None, read_err=True,
-             remote_cmd=None, extension=None, keep_for=None):
+             remote_cmd=None, extension=None, keep_for=None, jobs=1):
     """Backup subvolumes to a repository."""
     src = Repository(self._src_repo, send_filters, read_err)
     if extension:
@@ -46,7 +46,7 @@ class Program:
     else:
       dst = Repository(self._dst_repo, recv_filters, read_err, remote_cmd)
 
-    sync(self._subvolumes, src, dst)
+    sync(self._subvolumes, src, dst, jobs)
     if keep_for:
       src.purge(self._subvolumes, keep_for)
 
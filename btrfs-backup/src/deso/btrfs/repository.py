@@ -25,8 +25,8 @@
   contain snapshots.
 """
 
-from copy import (
-  deepcopy,
+from concurrent.futures import (
+  ThreadPoolExecutor,
 )
 from datetime import (
   datetime,
@@ -54,8 +54,15 @@ from deso.execute import (
   execute,
   ProcessError,
 )
+from functools import (
+  lru_cache,
+)
+from operator import (
+  itemgetter,
+)
 from os import (
   curdir,
+  listdir,
   pardir,
   sep,
   uname,
@@ -71,8 +78,24 @@ from os.path import (
 )
 from re import (
   compile as regex,
+  MULTILINE,
+)
+from sys import (
+  intern,
 )
 
+try:
+  # The libbtrfsutil Python bindings are optional. If they are available
+  # we use them for listing snapshots in local repositories, saving us
+  # from spawning a btrfs process and parsing its output.
+  from btrfsutil import (
+    SubvolumeIterator,
+    subvolume_id,
+    subvolume_path,
+  )
+except ImportError:
+  SubvolumeIterator = None
+
 
 # The time format for the creation time of a snapshot. This format is
 # used for deriving time stamps to be included in a snapshot's name.
@@ -90,17 +113,36 @@ _ANY_STRING = r"."
 _NUM_STRING = r"[0-9]"
 _NUMS_STRING = r"{nr}+".format(nr=_NUM_STRING)
 _PATH_STRING = r"{any}+".format(any=_ANY_STRING)
+# The time stamp as contained in a snapshot's name, optionally followed
+# by a number making the name unique. It is matched directly after a
+# snapshot's base name and has to extend to the end of the name.
+_TIME_STRING = _TIME_FORMAT_RAW.replace("{}", "%s{4,}" % _NUM_STRING, 1)
+_TIME_STRING = _TIME_STRING.replace("{}", "%s{2}" % _NUM_STRING)
+_TIME_REGEX = regex(r"(%s)(?:-%s)?$" % (_TIME_STRING, _NUMS_STRING))
 # The format of a line as retrieved by executing the command returned by
 # the snapshots() function. Each line is expected to be following the
 # pattern:
 # ID A gen B top level C path PATH
+# The expression is applied to the entire output at once, hence the
+# multi-line mode. Apart from the path all fields are plain ASCII, so we
+# match on the raw bytes (which also spares us Unicode matching
+# semantics) and only decode the paths we extracted.
 _LIST_STRING = r"^ID {nums} gen ({nums}) top level {nums} path ({path})$"
-_LIST_REGEX = regex(_LIST_STRING.format(nums=_NUMS_STRING, path=_PATH_STRING))
+_LIST_REGEX = regex(_LIST_STRING.format(nums=_NUMS_STRING, path=_PATH_STRING)
+                    .encode("ascii"), MULTILINE)
+# The expression for splitting numbers off a string.
+_NUMBER_REGEX = regex(r"(%s)" % _NUMS_STRING)
+# The flag marking a subvolume as read-only in its root item.
+_ROOT_SUBVOL_RDONLY = 1 << 0
 # The marker ending the file list reported by the diff() function. If
-# this marker is the only thing reported then no files have changed.
-_DIFF_END_MARKER = "transid marker"
+# this marker is the only thing reported then no files have changed. It
+# is kept in encoded form as the output is compared as raw bytes.
+_DIFF_END_MARKER = b"transid marker"
 # The separator of path elements in encoded form.
 _PATH_ELEMENT_SEPARATOR = "@"
+# The maximum number of snapshots to delete with a single command. The
+# limit keeps us well below the maximum command line length.
+_DELETE_BATCH_SIZE = 256
 
 
 def _encodePath(path):
@@ -114,9 +156,13 @@ def _encodePath(path):
   # We allow only for absolute paths to be passed in (abspath always
   # returns an untrailed path).
   assert _untrail(path) == abspath(path), path
-  path = path.replace(_PATH_ELEMENT_SEPARATOR, _PATH_ELEMENT_SEPARATOR * 2)
-  path = path.replace(sep, _PATH_ELEMENT_SEPARATOR)
-  return path
+  # Escape existing separators and replace the native ones in a single
+  # pass.
+  table = {
+    ord(_PATH_ELEMENT_SEPARATOR): _PATH_ELEMENT_SEPARATOR * 2,
+    ord(sep): _PATH_ELEMENT_SEPARATOR,
+  }
+  return path.translate(table)
 
 
 def _decodePath(string):
@@ -126,25 +172,37 @@ def _decodePath(string):
     separator or not the result of this function will always contain
     one.
   """
-  # Careful not to replace escaped versions of the separator string.
-  string = string.replace(_PATH_ELEMENT_SEPARATOR * 2, "{d}")
-  string = string.replace(_PATH_ELEMENT_SEPARATOR, "{s}")
-  string = string.format(d=_PATH_ELEMENT_SEPARATOR, s=sep)
+  # Careful not to replace escaped versions of the separator string: we
+  # split at the escaped ones and only replace separators in between.
+  parts = string.split(_PATH_ELEMENT_SEPARATOR * 2)
+  parts = [part.replace(_PATH_ELEMENT_SEPARATOR, sep) for part in parts]
+  string = _PATH_ELEMENT_SEPARATOR.join(parts)
   assert _untrail(string) == abspath(string), string
   return string
 
 
-def _parseListLine(line):
-  """Parse a line of output of the command as returned by snapshots()."""
-  m = _LIST_REGEX.match(line)
-  if not m:
-    raise ValueError("Invalid snapshot list: unable to match line \"%s\"" % line)
+def _parseList(output):
+  """Parse the output of the command as returned by snapshots()."""
+  expression = _LIST_REGEX
+  # We match the entire output in a single pass instead of splitting it
+  # into lines and matching each of them separately. Retrieving plain
+  # tuples of the groups furthermore spares us the creation of a match
+  # object per line.
+  # Paths that are not valid UTF-8 are decoded with surrogate escapes
+  # so that they still map back to the original file name.
+  result = [{"gen": int(gen), "path": path.decode("utf-8", "surrogateescape")}
+            for gen, path in expression.findall(output)]
+
+  # Lines not adhering to the expected format are silently skipped by
+  # findall(). Detect them by comparing the number of matches against
+  # the number of lines and only then search for the culprit.
+  lines = output.count(b"\n") + (0 if output.endswith(b"\n") else 1)
+  if len(result) != lines:
+    for line in output.split(b"\n"):
+      if not expression.match(line):
+        line = line.decode("utf-8", "replace")
+        raise ValueError("Invalid snapshot list: unable to match line \"%s\"" % line)
 
-  gen, path = m.groups()
-
-  result = {}
-  result["gen"] = int(gen)
-  result["path"] = path
   return result
 
 
@@ -158,7 +216,15 @@ def _snapshots(repository):
       testRepositoryListNoSnapshotPresentInSubdir. For that matter,
       usage of this function is discouraged. Use the Repository's
       snapshots() method instead.
+
+    The list is sorted by path. Since the name of each snapshot contains
+    its creation time stamp in a sortable format, this order is also
+    chronological for the snapshots of a subvolume and clients can rely
+    on it without sorting again.
   """
+  if SubvolumeIterator is not None and repository.local:
+    return _snapshotsNative(repository)
+
   cmd = repository.command(listSnapshots, repository.path())
   output, _ = execute(*cmd, stdout=b"", stderr=repository.stderr)
   # We might retrieve an empty output if no snapshots were present. In
@@ -166,9 +232,43 @@ def _snapshots(repository):
   if not output:
     return []
 
-  # Convert from byte array and split to retrieve a list of lines.
-  output = output.decode("utf-8").splitlines()
-  return [_parseListLine(line) for line in output]
+  return _parseList(output)
+
+
+def _snapshotsNative(repository):
+  """Retrieve a list of snapshots in a repository by means of libbtrfsutil.
+
+    The result is the same as that of running and parsing the command
+    returned by snapshots(): All read-only subvolumes directly below the
+    subvolume containing the repository's directory, with their paths
+    being relative to the btrfs root and the list sorted by path.
+  """
+  directory = repository.path()
+  top = subvolume_id(directory)
+  # The iterator reports paths relative to the subvolume it starts
+  # from. We need them relative to the btrfs root.
+  base = subvolume_path(directory)
+
+  result = []
+  for path, info in SubvolumeIterator(directory, info=True):
+    if info.parent_id == top and info.flags & _ROOT_SUBVOL_RDONLY:
+      result.append({"gen": info.generation, "path": join(base, path)})
+
+  return sorted(result, key=itemgetter("path"))
+
+
+def _versionKey(string):
+  """Create a sort key for a string treating contained numbers numerically.
+
+    The order is meant to resemble that of 'ls -v' for the file names we
+    deal with: numbers are compared by their value, so that "name-2"
+    comes before "name-10".
+  """
+  # Splitting with a capturing group yields strings at even and numbers
+  # at odd indices, so keys of two strings can always be compared.
+  parts = _NUMBER_REGEX.split(string)
+  parts[1::2] = map(int, parts[1::2])
+  return parts
 
 
 def _snapshotFiles(directory, extension, repository):
@@ -180,24 +280,37 @@ def _snapshotFiles(directory, extension, repository):
   # numbered in an increasing fashion.
   expression = regex(r"^%s.*-%s.*%s$" % (base, time, extension))
 
-  # We have to rely on the '-v' parameter here to get a properly sorted
-  # list and '-1' to display one file per line. We should not have to
-  # use --color=never since coloring should not be applied here since
-  # everything is non-interactive.
-  cmd = repository.command(lambda: ["/bin/ls", "-v", "-1", directory])
-  out, _ = execute(*cmd, stdout=b"", stderr=repository.stderr)
-  out = out.decode("utf-8").splitlines()
+  if repository.local:
+    # For local repositories we can read the directory directly instead
+    # of spawning a process. We sort the snapshots ourselves below.
+    out = listdir(directory)
+  else:
+    # We have to rely on the '-v' parameter here to get a properly
+    # sorted list and '-1' to display one file per line. We should not
+    # have to use --color=never since coloring should not be applied
+    # here since everything is non-interactive.
+    cmd = repository.command(lambda: ["/bin/ls", "-v", "-1", directory])
+    out, _ = execute(*cmd, stdout=b"", stderr=repository.stderr)
+    out = out.decode("utf-8", "surrogateescape").splitlines()
 
   # In general we assume that the repository's directory does not
   # contain any user created files with which we could interfere.
   # However, we also try a little bit to filter out most files that
   # cannot possibly be snapshots because their naming scheme does not
-  # match.
-  files = []
+  # match. The cheap prefix and suffix checks rule out most foreign
+  # files before we resort to matching the regular expression.
+  names = []
   for f in out:
-    m = expression.match(f)
-    if m:
-      files.append({"path": join(directory, f[:-len(extension)])})
+    if f.startswith(base) and f.endswith(extension) and expression.match(f):
+      names.append(f[:-len(extension)])
+
+  # Note that we sort the names without the extension, just as 'ls -v'
+  # ignores it, so that a snapshot without a number comes before the
+  # numbered ones created at the same time.
+  if repository.local:
+    names.sort(key=_versionKey)
+
+  files = [{"path": join(directory, name)} for name in names]
 
   # We got a list of file names. However, our snapshot format is that of
   # a dict containing a 'path' key. Note that since we are unable to
@@ -220,13 +333,18 @@ def _findSubvolPath(directory, repository):
     # to the btrfs root.
     cmd = repository.command(resolveId, id_, directory)
     output, _ = execute(*cmd, stdout=b"", stderr=repository.stderr)
-    return output[:-1].decode("utf-8")
+    return output[:-1].decode("utf-8", "surrogateescape")
   except ProcessError:
     return None
 
 
 def _isDir(directory, repository):
   """Check if a directory exists."""
+  # For local repositories we can check directly instead of spawning a
+  # process.
+  if repository.local:
+    return isdir(directory)
+
   try:
     # Append a trailing separator here to indicate that we are
     # checking for a directory. This way ls will fail if it is not. If
@@ -293,10 +411,17 @@ def _snapshotBaseName(subvolume):
     information encoded in it and does not depend on data variable over
     time.
   """
+  # Querying the system's identity is cheap, but everything derived
+  # from it is cached.
+  return _baseName(uname(), subvolume)
+
+
+@lru_cache(maxsize=None)
+def _baseName(system, subvolume):
+  """Retrieve the base name of a snapshot for the given system and subvolume."""
   assert subvolume is None or subvolume == realpath(subvolume)
 
-  r = uname()
-  name = "%s-%s-%s" % (r.nodename, r.sysname.lower(), r.machine)
+  name = "%s-%s-%s" % (system.nodename, system.sysname.lower(), system.machine)
   if subvolume:
     # Remove any leading or trailing directory separators and then replace
     # the ones in the middle with underscores to make names look less
@@ -317,6 +442,7 @@ def _ensureUniqueName(snapshot, snapshots):
   """
   i = 1
   name = snapshot
+  existing = {s["path"] for s in snapshots}
 
   # Note that there might be multiple snapshots created this way, so not
   # just pick the first number and be done but actually verify that the
@@ -329,7 +455,7 @@ def _ensureUniqueName(snapshot, snapshots):
   #       last. We luck out because the time format already contains a
   #       dash as a separator so the existing test covers this case as
   #       well.
-  while _findSnapshotByName(snapshots, name):
+  while name in existing:
     name = "%s-%s" % (snapshot, i)
     i = i + 1
 
@@ -358,24 +484,26 @@ def _findSnapshotsForSubvolume(snapshots, subvolume):
   # sub-directory, otherwise we cannot simply compare the base against
   # the beginning of the string. This is a valid assumption for this
   # program, though.
-  return list(filter(lambda x: x["path"].startswith(base), snapshots))
+  return [x for x in snapshots if x["path"].startswith(base)]
 
 
 def _findMostRecent(snapshots, subvolume):
   """Given a list of snapshots, find the most recent one."""
-  snapshots = _findSnapshotsForSubvolume(snapshots, subvolume)
-
-  if not snapshots:
-    return None
+  base = _snapshotBaseName(subvolume)
 
   # The most recent snapshot is the last since we list snapshots in
-  # ascending order by date.
-  return snapshots[-1]
+  # ascending order by date. So search from the back and stop at the
+  # first snapshot of the subvolume.
+  for snapshot in reversed(snapshots):
+    if snapshot["path"].startswith(base):
+      return snapshot
+
+  return None
 
 
 def _findSnapshotByName(snapshots, name):
   """Check if a list of snapshots contains a given one."""
-  snapshots = list(filter(lambda x: x["path"] == name, snapshots))
+  snapshots = [x for x in snapshots if x["path"] == name]
 
   if not snapshots:
     return None
@@ -389,19 +517,18 @@ def _findCommonSnapshots(src_snaps, dst_snaps):
   # Note that although not strictly required we want to keep the
   # snapshot dicts with all their meta-data and not reduce them to
   # simple paths, i.e., strings. We achieve that by creating the set of
-  # paths that is common to both repositories and then just filtering
-  # out all other paths from one of the original lists.
-  src_paths = set(map(lambda x: x["path"], src_snaps))
-  dst_paths = set(map(lambda x: x["path"], dst_snaps))
-
-  # Note that by using set intersection here we assume that there is a uniform
-  # style of trailing directory separators used. This fact is ensured by the
-  # Repository's snapshots() method.
-  paths = src_paths & dst_paths
+  # paths of the longer list and then filtering out all other paths
+  # from the shorter one in a single pass.
+  # Note that by comparing paths here we assume that there is a uniform
+  # style of trailing directory separators used. This fact is ensured by
+  # the Repository's snapshots() method.
+  if len(src_snaps) <= len(dst_snaps):
+    snaps, others = src_snaps, dst_snaps
+  else:
+    snaps, others = dst_snaps, src_snaps
 
-  # Work on the list with fewer items.
-  snaps = src_snaps if len(src_snaps) <= len(dst_snaps) else dst_snaps
-  return filter(lambda x: x["path"] in paths, snaps)
+  paths = {x["path"] for x in others}
+  return [x for x in snaps if x["path"] in paths]
 
 
 def _createSnapshot(subvolume, repository, snapshots):
@@ -436,35 +563,31 @@ def _findOrCreate(subvolume, repository, snapshots):
 
 def _makeRelative(snapshots, directory):
   """Convert a list of absolute snapshots into a list with relative ones."""
-  # We only want to loop once but we need to remove items during
-  # iteration. So we iterate over a copy while deleting from the
-  # original. In order to ensure all indices are valid even in the face
-  # of deletion, we need to iterate from back to front. The enumerate
-  # function counts in ascending order so for the deletion we need to
-  # subtract the index from the length of the original array but because
-  # of reverse iteration we need to subtract one more.
-  rlen = len(snapshots) - 1
-  copy = snapshots.copy()
-
-  for i, snapshot in enumerate(reversed(copy)):
+  length = len(directory)
+  result = []
+
+  for snapshot in snapshots:
     path = snapshot["path"]
-    # Check if the snapshot is not located in this repository's
-    # directory.
+    # Snapshots not located in this repository's directory are sorted
+    # out. For valid ones we remove the now common prefix.
     if path.startswith(directory):
-      # Valid snapshot. Remove the now common prefix.
-      snapshot["path"] = path[len(directory):]
-    else:
-      # Snapshot not in our directory. Remove it from the list.
-      del snapshots[rlen - i]
+      snapshot["path"] = path[length:]
+      result.append(snapshot)
+
+  return result
 
-  return snapshots
 
+def _deploy(snapshot, parent, src, dst, src_snaps, subvolume, dst_snaps=None):
+  """Deploy a snapshot to a repository.
 
-def _deploy(snapshot, parent, src, dst, src_snaps, subvolume):
-  """Deploy a snapshot to a repository."""
+    If a list of snapshots in the destination repository is provided it
+    is used instead of retrieving a new one and the deployed snapshot
+    gets added to it.
+  """
   if parent:
     # Retrieve a list of snapshots in the destination repository.
-    dst_snaps = dst.snapshots()
+    if dst_snaps is None:
+      dst_snaps = dst.snapshots()
 
     # In case the snapshot did already exist, i.e., we did not create a
     # new one, the parent and the "current" snapshot are equal. And only
@@ -493,6 +616,11 @@ def _deploy(snapshot, parent, src, dst, src_snaps, subvolume):
 
   runCommands(src_cmds + dst_cmds, stderr=stderr)
 
+  if dst_snaps is not None:
+    # We only know the path of the new snapshot but that is all that is
+    # required for finding it or using it as a parent later on.
+    dst_snaps.append({"path": snapshot})
+
 
 def _sync(subvolume, src, dst):
   """Sync a single subvolume between two repositories.
@@ -523,21 +651,49 @@ def _sync(subvolume, src, dst):
   _deploy(snapshot, parent, src, dst, snapshots, subvolume)
 
 
-def sync(subvolumes, src, dst):
-  """Sync the given subvolumes between two repositories, i.e., this one and a "remote" one."""
-  # Note that when we synchronize multiple subvolumes and one of the
-  # last subvolume synchronizations fails (for whatever reason), the
-  # previously created and sync'ed snapshots will stay. This behavior is
-  # by design. Whenever a unit is successfully backed up we leave it
-  # this way.
-  for subvolume in subvolumes:
-    # Note that we use realpath here rather than abspath because we care
-    # about the uniqueness of snapshot names and so the given subvolume
-    # path has to be in canonical form.
-    _sync(realpath(subvolume), src, dst)
+def _syncJobs(count, jobs):
+  """Determine the number of subvolumes to sync concurrently."""
+  # There is no point in having more jobs than subvolumes.
+  return max(min(count, jobs), 1)
 
 
-def _restore(subvolume, src, dst, snapshots, snapshots_only):
+def sync(subvolumes, src, dst, jobs=1):
+  """Sync the given subvolumes between two repositories, i.e., this one and a "remote" one."""
+  # Note that when we synchronize multiple subvolumes and one of the
+  # subvolume synchronizations fails (for whatever reason), the other
+  # created and sync'ed snapshots will stay. This behavior is by design.
+  # Whenever a unit is successfully backed up we leave it this way.
+  # Note that we use realpath here rather than abspath because we care
+  # about the uniqueness of snapshot names and so the given subvolume
+  # path has to be in canonical form.
+  subvolumes = [realpath(subvolume) for subvolume in subvolumes]
+
+  jobs = _syncJobs(len(subvolumes), jobs)
+  if jobs == 1:
+    for subvolume in subvolumes:
+      _sync(subvolume, src, dst)
+    return
+
+  # The subvolumes are independent of each other (their snapshots all
+  # have distinct names) and syncing them is mostly waiting for
+  # processes, so if desired we overlap their synchronization. Results
+  # are retrieved in order, causing the error of the first failed
+  # subvolume to be reported.
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    futures = [executor.submit(_sync, s, src, dst) for s in subvolumes]
+    try:
+      for future in futures:
+        future.result()
+    except:
+      # Just as in the serial case, do not start syncing any more
+      # subvolumes once one failed. Those already in progress are
+      # waited for, though.
+      for future in futures:
+        future.cancel()
+      raise
+
+
+def _restore(subvolume, src, dst, snapshots, dst_snaps, snapshots_only):
   """Restore a snapshot/subvolume by transferal from another repository."""
   snapshot = _findMostRecent(snapshots, subvolume)
 
@@ -564,7 +720,7 @@ def _restore(subvolume, src, dst, snapshots, snapshots_only):
 
   # Restoration of a subvolume involves a subset of the steps we do
   # when we perform a full sync: the deployment.
-  _deploy(snapshot, snapshot, src, dst, snapshots, subvolume)
+  _deploy(snapshot, snapshot, src, dst, snapshots, subvolume, dst_snaps)
 
   # Now that we got the snapshot back on the destination repository,
   # we can restore the actual subvolume from it (if desired).
@@ -579,10 +735,13 @@ def restore(subvolumes, src, dst, snapshots_only=False):
   # of snapshots on the source after every subvolume transfer because in
   # this step we are sure that we do not create any new snapshots (and
   # we assume nobody else does).
+  # The same holds for the destination, except for the snapshots we
+  # transfer, which get added to the list as we go.
   snapshots = src.snapshots()
+  dst_snaps = dst.snapshots()
 
   for subvolume in subvolumes:
-    _restore(realpath(subvolume), src, dst, snapshots, snapshots_only)
+    _restore(realpath(subvolume), src, dst, snapshots, dst_snaps, snapshots_only)
 
 
 def _changed(snapshot, subvolume, repository):
@@ -605,39 +764,81 @@ def _changed(snapshot, subvolume, repository):
   # the encoding. Although we could use sys.getfilesystemencoding() to
   # get the encoding used in the file system, cases were seen where file
   # names still contained undecodable characters (such as 0xbb).
-  return not output.startswith(_DIFF_END_MARKER.encode("utf-8"))
+  return not output.startswith(_DIFF_END_MARKER)
+
+
+@lru_cache(maxsize=None)
+def _parseDate(date):
+  """Parse the date part of a snapshot time stamp into a tuple of ints.
+
+    Snapshots are usually clustered on few days, so we remember the
+    result for each date string seen.
+  """
+  year, month, day = date.split("-")
+  return int(year), int(month), int(day)
+
+
+def _parseTimestamp(timestamp):
+  """Parse a time stamp as contained in a snapshot's name."""
+  # The time part is of a fixed width whereas the year may have more
+  # than four digits.
+  date, time = timestamp[:-9], timestamp[-8:]
+  year, month, day = _parseDate(date)
+  # Constructing the datetime object directly is a lot cheaper than
+  # parsing via strptime(). Invalid values are still rejected with a
+  # ValueError.
+  return datetime(year, month, day, int(time[0:2]), int(time[3:5]), int(time[6:8]))
 
 
 def _purge(subvolume, repository, duration, snapshots):
   """Remove unused snapshots from a repository."""
   # Store the time we work with so that it does not change.
   now = datetime.now()
-  snapshots = _findSnapshotsForSubvolume(snapshots, subvolume)
+  # All snapshots of the subvolume start with the same base name which
+  # is directly followed by the time stamp.
+  length = len(_snapshotBaseName(subvolume))
+  matches = []
+
+  for snapshot in _findSnapshotsForSubvolume(snapshots, subvolume):
+    m = _TIME_REGEX.match(snapshot["path"], length)
+    # The base name of a subvolume can be a prefix of that of another
+    # one (think "/home" and "/home-user"). Snapshots of the latter
+    # have a time stamp, just not directly after our base name. They
+    # are none of our business.
+    if not m and _TIME_REGEX.search(snapshot["path"], length):
+      continue
+
+    matches.append((snapshot, m))
 
   # The list of snapshots is sorted in ascending order, that is, the
   # oldest snapshots will be at the beginning. Note that we exclude the
   # most recent snapshot, i.e., the last one in the list. It should
   # never be deleted.
-  for snapshot in snapshots[:-1]:
-    snapshot = snapshot["path"]
-    time_str = _TIME_FORMAT_RAW
-    time_str = time_str.replace("{}", "%s{4,}" % _NUM_STRING, 1)
-    time_str = time_str.replace("{}", "%s{2}" % _NUM_STRING)
-    time_re = regex(r".*(%s)(?:-[0-9]\+){0,1}" % time_str)
-
-    m = time_re.match(snapshot)
-    if not m:
+  paths = []
+  for snapshot, m in matches[:-1]:
+    time = None
+    if m:
+      try:
+        time = _parseTimestamp(m.group(1))
+      except ValueError:
+        pass
+
+    if time is None:
       error = "Snapshot name does not contain a time stamp: \"{s}\""
-      error = error.format(s=snapshot)
+      error = error.format(s=snapshot["path"])
       raise ValueError(error)
 
-    timestamp, = m.groups()
-    # Parse the time stamp into a datetime value and check whether it is
-    # old enough so that the snapshot should be deleted.
-    time = datetime.strptime(timestamp, _TIME_FORMAT)
+    # Check whether the snapshot is old enough so that it should be
+    # deleted.
     if time + duration < now:
-      cmd = repository.command(delete, repository.path(snapshot))
-      execute(*cmd, stderr=repository.stderr)
+      paths.append(snapshot["abspath"])
+
+  # Deleting multiple snapshots with a single command saves us from
+  # spawning a process (and potentially connecting to a remote host)
+  # for each of them.
+  for i in range(0, len(paths), _DELETE_BATCH_SIZE):
+    cmd = repository.command(delete, *paths[i:i + _DELETE_BATCH_SIZE])
+    execute(*cmd, stderr=repository.stderr)
 
 
 def _trail(path):
@@ -677,7 +878,9 @@ class RepositoryBase:
     # TODO: We could use a better story for path handling. The main
     #       concern are probably character based path comparisons (for
     #       prefixes, for instance).
-    self._directory = _trail(_relativize(directory))
+    # The directory is the common prefix of all paths we form and is
+    # interned so that equal prefixes are shared among repositories.
+    self._directory = intern(_trail(_relativize(directory)))
 
   def snapshots(self):
     """Retrieve a list of snapshots in this repository."""
@@ -698,6 +901,11 @@ class RepositoryBase:
 
   def path(self, *components):
     """Form an absolute path by combining the given path components."""
+    # The directory always carries a trailing separator, so the common
+    # case of a single relative component boils down to concatenation.
+    if len(components) == 1 and not isabs(components[0]):
+      return self._directory + components[0]
+
     return join(self._directory, *components)
 
 
@@ -717,6 +925,12 @@ class RepositoryBase:
     pass
 
 
+  @property
+  def local(self):
+    """Check whether the repository is located on the local host."""
+    return not self._remote_cmd
+
+
   @property
   def stderr(self):
     """Retrieve the value to use as stderr keyword parameter when using an execution function."""
@@ -744,14 +958,13 @@ class Repository(RepositoryBase):
       raise FileNotFoundError("Root of btrfs file system not found for "
                               "directory: \"%s\"" % self._directory)
 
+    # The path of the subvolume containing the repository's directory is
+    # determined lazily but only once, as it requires running commands.
+    self._subvol_path = None
+
 
   def snapshots(self):
     """Retrieve a list of snapshots in this repository."""
-    def makeAbsolute(snapshot):
-      """Convert a snapshot relative to the root directory to an absolute one."""
-      snapshot["path"] = join(self._root, snapshot["path"])
-      return snapshot
-
     # The list of snapshots we are going to retrieve can be "wrong" in a
     # variety of ways one would not expect given the intuitively simple
     # task of listing snapshots. If, for example, a subvolume of a btrfs
@@ -762,26 +975,45 @@ class Repository(RepositoryBase):
     # adventurous: We find the subvolume containing "our" directory and
     # retrieve its name. We then replace the last part of "our"
     # directory with this name and use the result as the "expected"
-    # directory in the _makeRelative invocation.
-    subvol_path = _trail(_findSubvolPath(self._root, self))
-
-    snapshots = _snapshots(self)
-    snapshots = _makeRelative(snapshots, subvol_path)
-    # Make all paths absolute.
-    snapshots = list(map(makeAbsolute, snapshots))
-    # We need to work around the btrfs problem that not necessarily all
-    # snapshots listed are located in our repository's directory. This
-    # is done as one step along with converting the absolute snapshot
-    # paths to relative ones where we just sort out everything not below
-    # our directory.
-    snapshots = _makeRelative(snapshots, self._directory)
+    # prefix of all snapshot paths.
+    if self._subvol_path is None:
+      self._subvol_path = _trail(_findSubvolPath(self._root, self))
+
+    subvol_path = self._subvol_path
+    subvol_length = len(subvol_path)
+    directory = self._directory
+    length = len(directory)
+    snapshots = []
+
+    # We convert the snapshot paths in a single pass: First we strip the
+    # subvolume prefix and make the result absolute. Then we need to work
+    # around the btrfs problem that not necessarily all snapshots listed
+    # are located in our repository's directory. This is done along with
+    # converting the absolute snapshot paths to relative ones where we
+    # just sort out everything not below our directory.
+    for snapshot in _snapshots(self):
+      path = snapshot["path"]
+      if not path.startswith(subvol_path):
+        continue
+
+      path = join(self._root, path[subvol_length:])
+      if not path.startswith(directory):
+        continue
+
+      # The absolute path is kept around under a separate key because it
+      # is what operations on the snapshot itself (e.g., its deletion)
+      # require. This way it does not have to be formed again later.
+      snapshot["abspath"] = path
+      snapshot["path"] = path[length:]
+      snapshots.append(snapshot)
 
     # TODO: We currently return a list of snapshots in the internally
-    #       used format, i.e., dicts that contain a 'path' and a 'gen'
-    #       key. Clients should not require the latter information
-    #       and, thus, only the paths should be exposed to the
-    #       outside. Such a change might require some adjustments,
-    #       however, and it is unclear whether it is worth the effort.
+    #       used format, i.e., dicts that contain a 'path', an
+    #       'abspath', and a 'gen' key. Clients should not require the
+    #       latter information and, thus, only the paths should be
+    #       exposed to the outside. Such a change might require some
+    #       adjustments, however, and it is unclear whether it is worth
+    #       the effort.
     return snapshots
 
 
@@ -795,6 +1027,11 @@ class Repository(RepositoryBase):
     #       snapshots is from the sync() function. When in this function
     #       we have already queried all snapshots and can work with them
     #       instead of gathering a new list here.
+    # Without any subvolumes there is nothing to purge and we can skip
+    # listing the snapshots altogether.
+    if not subvolumes:
+      return
+
     snapshots = self.snapshots()
 
     for subvolume in subvolumes:
@@ -829,8 +1066,11 @@ class Repository(RepositoryBase):
     # the destination side, we have to send the latest snapshot in its
     # entirety (i.e., the entire subvolume).
     parents = _findCommonSnapshots(snapshots, dst_snapshots)
-    # Convert the snapshot list to paths relative to the source repository.
-    parents = list(map(lambda x: self.path(x["path"]), parents))
+    # Convert the snapshot list to paths relative to the source
+    # repository. Snapshot paths are always relative, so we can just
+    # prepend the (trailed) directory.
+    directory = self._directory
+    parents = [directory + x["path"] for x in parents]
     return parents
 
 
@@ -894,12 +1134,15 @@ class FileRepository(RepositoryBase):
     """Retrieve a list of parent snapshots for the given snapshot of the supplied subvolume."""
     assert snapshots is not None
 
-    snapshots = _findSnapshotsForSubvolume(snapshots, subvolume)
     # TODO: This method is not yet complete. We need to include only
     #       those snapshots that are true parents of the given one. That
     #       is, we have to stop at the last full snapshot.
-    snapshots = filter(lambda x: x["path"] != snapshot, snapshots)
-    return list(map(lambda x: self.path(x["path"]), snapshots))
+    # Selecting the snapshots of the subvolume and excluding the given
+    # one is done in the same pass that creates the paths.
+    base = _snapshotBaseName(subvolume)
+    directory = self._directory
+    return [directory + path for path in map(itemgetter("path"), snapshots)
+            if path.startswith(base) and path != snapshot]
 
 
   def _filterPipeline(self, index, snapshots):
@@ -907,13 +1150,20 @@ class FileRepository(RepositoryBase):
     # Convert all relative snapshot paths into absolute ones with the
     # appropriate extension.
     with alias(self._extension) as ext:
-      snapshots = ["%s%s" % (self.path(s), ext) for s in snapshots]
+      snapshots = [self.path(s) + ext for s in snapshots]
 
-    commands = deepcopy(self._filters)
-    func = lambda: replaceFileString(commands[index], snapshots)
+    # Only the filter at the given index gets modified. The {file}
+    # replacement only ever changes the top-level list of it (commands
+    # inside a spring are replicated before they are adjusted), so
+    # shallow copies suffice.
+    commands = self._filters.copy()
     # At least one command in the filters must contain a string {file}
-    # which is now replaced by the actual snapshot name.
-    commands[index] = self.command(func)
+    # which is now replaced by the actual snapshot name. The replacement
+    # function is handed to command() directly, along with its
+    # arguments, instead of wrapping it in a closure on every call.
+    commands[index] = self.command(replaceFileString,
+                                   commands[index].copy(),
+                                   snapshots)
     return commands
 
 
@@ -27,19 +27,24 @@
   that contain well defined execution environments.
 """
 
+from atexit import (
+  register,
+)
 from deso.btrfs.alias import (
   alias,
 )
 from deso.btrfs.command import (
   create,
   snapshot,
+  sync,
 )
 from deso.btrfs.repository import (
   Repository,
 )
 from deso.btrfs.test.util import (
   mkdtemp,
-  mkstemp,
+  mkstempInMemory,
+  openUnnamedInMemory,
 )
 from deso.execute import (
   execute,
@@ -48,12 +53,16 @@ from deso.execute import (
 from os import (
   O_CREAT,
   O_EXCL,
+  O_RDONLY,
   O_RDWR,
   close,
+  ftruncate,
   makedirs,
   open as open_,
+  read,
   remove,
   rmdir,
+  strerror,
   symlink,
   write,
 )
@@ -61,6 +70,9 @@ from os.path import (
   dirname,
   join,
 )
+from shlex import (
+  quote,
+)
 from unittest import (
   TestCase,
 )
@@ -69,8 +81,42 @@ from unittest import (
 _LOSETUP = findCommand("losetup")
 _MKBTRFS = findCommand("mkfs.btrfs")
 _MOUNT = findCommand("mount")
+_SH = findCommand("sh")
 _UMOUNT = findCommand("umount")
 
+# Options used for mounting the file systems of the test case base
+# classes. These file systems are short lived, so we do not need to pay
+# for updating access times or maintaining ACLs. Mount itself does not
+# apply them, so that tests mounting a device explicitly get exactly the
+# options they ask for.
+# Options affecting how data is stored (such as nodatacow or nodatasum)
+# are deliberately not used, as they change how received data is cloned
+# and verified in the send/receive tests.
+_MOUNT_OPTIONS = ["noatime", "noacl"]
+
+try:
+  from ctypes import (
+    CDLL,
+    get_errno,
+  )
+
+  # syncfs(2) is not exposed by the os module. Look it up in the C
+  # library the interpreter is linked against.
+  _SYNCFS = CDLL(None, use_errno=True).syncfs
+except (ImportError, AttributeError, OSError):
+  _SYNCFS = None
+
+# Mount point directories that are no longer in use and can be handed
+# out again instead of creating and removing one for every test.
+_MOUNT_POINTS = []
+
+
+@register
+def _removeMountPoints():
+  """Remove all pooled mount point directories."""
+  while _MOUNT_POINTS:
+    rmdir(_MOUNT_POINTS.pop())
+
 
 def createFile(path, content=None):
   """Create a file given an absolute path."""
@@ -82,6 +128,28 @@ def createFile(path, content=None):
     close(fd)
 
 
+def syncFileSystem(path):
+  """Persist the file system containing the given path to disk."""
+  if _SYNCFS is None:
+    execute(*sync(path))
+    return
+
+  # Unlike sync(2), syncfs(2) only flushes the one file system the
+  # descriptor belongs to and it does so without spawning a process.
+  fd = open_(path, O_RDONLY)
+  try:
+    if _SYNCFS(fd) != 0:
+      errno = get_errno()
+      raise OSError(errno, strerror(errno), path)
+  finally:
+    close(fd)
+
+
+def toShell(command):
+  """Convert a command, as used by execute, into a shell command line."""
+  return " ".join(map(quote, command))
+
+
 def make(container, *components, data=None, link=None, subvol=False):
   """Create a file, symlink, directory, or subvolume relative to an object with a path() method."""
   def assertOneMax(x, y, z):
@@ -111,25 +179,29 @@ class LoopBackDevice:
   """A class representing a loop back device."""
   def __init__(self, size):
     """Create a new loop back device backed by a file of given size."""
-    # We start with retrieving the path to a loop device.
-    dev, _ = execute(_LOSETUP, "-f", stdout=b"")
-    # Now create a temporary file to use as loop device backing store.
-    fd, path = mkstemp()
+    # Create a temporary file to use as loop device backing store. As it
+    # is not needed once the device is set up it is best kept in memory
+    # and, if possible, without a name to begin with.
+    unnamed = openUnnamedInMemory()
+    fd, path = unnamed if unnamed else mkstempInMemory()
     try:
-      write(fd, b"\0" * size)
-
-      # Convert the byte array into a proper string and remove trailing
-      # newline.
-      self._loop_dev = dev.decode("utf-8")[:-1]
-      # Actually set up the loop device. Now we have an ordinary block
-      # device with absolute path 'self._loop_dev'.
-      execute(_LOSETUP, self._loop_dev, path)
+      # Extending the file this way leaves it sparse, so no data has to
+      # be written. The file system will write what it needs.
+      ftruncate(fd, size)
+
+      # Find a free loop device and set it up in a single step. Now we
+      # have an ordinary block device, the path of which gets reported.
+      dev, _ = execute(_LOSETUP, "--find", "--show", path, stdout=b"")
+      # Convert the byte array into a proper string and remove the
+      # trailing newline. Device paths are always plain ASCII.
+      self._loop_dev = dev.rstrip(b"\n").decode("ascii")
     finally:
       close(fd)
       # Now that the loop device is bound to the file we can already
       # unlink the file so that we do not have to take care of it any
       # longer.
-      remove(path)
+      if not unnamed:
+        remove(path)
 
 
   def __enter__(self):
@@ -165,7 +237,9 @@ class BtrfsDevice(LoopBackDevice):
     """
     super().__init__(size)
     try:
-      execute(_MKBTRFS, self.device())
+      # Discarding the blocks of a freshly created loop device is
+      # pointless, the backing file is empty anyway.
+      execute(_MKBTRFS, "--nodiscard", self.device())
     except:
       super().destroy()
       raise
@@ -175,12 +249,12 @@ class Mount:
   """A class used for mounting a device."""
   def __init__(self, dev, *options):
     """The constructor mounts the device in a temporary location."""
-    self._directory = mkdtemp()
+    self._directory = _MOUNT_POINTS.pop() if _MOUNT_POINTS else mkdtemp()
     try:
       args = ["-o", ",".join(options)] if options else []
       execute(_MOUNT, dev, self._directory, *args)
     except:
-      rmdir(self._directory)
+      _MOUNT_POINTS.append(self._directory)
       raise
 
 
@@ -195,9 +269,11 @@ class Mount:
 
 
   def destroy(self):
-    """Unmount the mounted device and remove the mount directory."""
+    """Unmount the mounted device and return the mount directory to the pool."""
     execute(_UMOUNT, self._directory)
-    rmdir(self._directory)
+    # Only an unmounted directory may be reused, which is why it is not
+    # returned to the pool should unmounting fail.
+    _MOUNT_POINTS.append(self._directory)
 
 
   def path(self, *components):
@@ -205,7 +281,25 @@ class Mount:
     return join(self._directory, *components)
 
 
-class BtrfsTestCase(TestCase):
+class BtrfsTestCaseBase(TestCase):
+  """A test case subclass with assertions useful for tests working on btrfs."""
+  def assertContains(self, file_, content):
+    """Verify that a file has the given content."""
+    if isinstance(content, str):
+      content = content.encode("utf-8")
+
+    fd = open_(file_, O_RDONLY)
+    try:
+      # Reading one byte more than expected suffices to detect a file
+      # with additional content.
+      data = read(fd, len(content) + 1)
+    finally:
+      close(fd)
+
+    self.assertEqual(data, content)
+
+
+class BtrfsTestCase(BtrfsTestCaseBase):
   """A test case subclass that provides a mounted btrfs device."""
   def setUp(self):
     """Create a btrfs device and mount it ready for use."""
@@ -213,7 +307,7 @@ class BtrfsTestCase(TestCase):
 
     self._device = BtrfsDevice()
     try:
-      self._mount = Mount(self._device.device())
+      self._mount = Mount(self._device.device(), *_MOUNT_OPTIONS)
     except:
       self._device.destroy()
       raise
@@ -227,10 +321,57 @@ class BtrfsTestCase(TestCase):
     super().tearDown()
 
 
-  def assertContains(self, file_, content):
-    """Verify that a file has the given content."""
-    with open(file_, "r") as handle:
-      self.assertEqual(handle.read(), content)
+class Directory:
+  """A class representing a directory in which paths can be formed."""
+  def __init__(self, directory):
+    """Create the directory, if it does not exist yet."""
+    makedirs(directory, exist_ok=True)
+    self._directory = directory
+
+
+  def path(self, *components):
+    """Form an absolute path by combining the given components."""
+    return join(self._directory, *components)
+
+
+class BtrfsSharedTestCase(BtrfsTestCaseBase):
+  """A test case subclass that provides a btrfs device shared by all tests.
+
+    Creating, formatting, and mounting a device is expensive. Test cases
+    deriving from this class share a single device across all their
+    tests instead. Each test works in a separate directory on it, so
+    tests do not see each other's files. Just as the mount object of a
+    BtrfsTestCase, the directory is available as '_mount' and supports
+    forming paths. Nothing is cleaned up between tests, the device as a
+    whole is discarded once all tests ran.
+  """
+  @classmethod
+  def setUpClass(cls):
+    """Create a btrfs device and mount it ready for use by all tests."""
+    super().setUpClass()
+
+    cls._device = BtrfsDevice()
+    try:
+      cls._shared_mount = Mount(cls._device.device(), *_MOUNT_OPTIONS)
+    except:
+      cls._device.destroy()
+      raise
+
+
+  @classmethod
+  def tearDownClass(cls):
+    """Unmount the shared btrfs device and destroy it."""
+    cls._shared_mount.destroy()
+    cls._device.destroy()
+
+    super().tearDownClass()
+
+
+  def setUp(self):
+    """Create the directory the test works in on the shared device."""
+    super().setUp()
+
+    self._mount = Directory(self._shared_mount.path(self._testMethodName))
 
 
 class BtrfsSnapshotTestCase(BtrfsTestCase):
@@ -246,11 +387,19 @@ class BtrfsSnapshotTestCase(BtrfsTestCase):
 
     try:
       with alias(self._mount) as m:
-        execute(*create(m.path("root")))
-        createFile(m.path("root", "file"))
-
-        execute(*snapshot(m.path("root"),
-                          m.path("root_snapshot")))
+        # Have a single shell create the subvolume, the file, and the
+        # snapshot instead of spawning a process for each btrfs command.
+        # With -e the script stops at the first failing command and -x
+        # traces every command to stderr, which becomes part of the
+        # reported error, so it is clear which step failed.
+        root = m.path("root")
+        script = "\n".join([
+          "set -e -x",
+          toShell(create(root)),
+          ": > %s" % quote(m.path("root", "file")),
+          toShell(snapshot(root, m.path("root_snapshot"))),
+        ])
+        execute(_SH, "-c", script)
     except:
       super().tearDown()
       raise
@@ -19,6 +19,10 @@
 
 """GnuPG public and private keys used for testing."""
 
+from base64 import (
+  b64decode,
+)
+
 
 PUBLIC_KEY = """
 -----BEGIN PGP PUBLIC KEY BLOCK-----
@@ -77,3 +81,18 @@ uglsV0zqCyFoD5s/CKJYwX6pMJiT2CRulh4=
 =OGCT
 -----END PGP PRIVATE KEY BLOCK-----
 """
+
+
+def dearmor(key):
+  """Convert an ASCII armored key into its binary form.
+
+    The result is the same as that of 'gpg --dearmor', but no process
+    has to be spawned for it.
+  """
+  lines = key.strip().splitlines()
+  # The armor header lines are separated from the data by an empty line.
+  # The data is followed by the checksum (starting with '=') and the
+  # armor tail.
+  start = lines.index("") + 1
+  end = next(i for i, line in enumerate(lines) if line.startswith("="))
+  return b64decode("".join(lines[start:end]))
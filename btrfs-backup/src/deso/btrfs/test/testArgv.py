@@ -66,10 +66,11 @@ class TestArgv(TestCase):
   def testReorderArgs(self):
     """Verify reordering of arguments works as expected."""
     arg = "--test-arg"
+    arg_value = "%s=test" % arg
 
     # Case 1) Only a single argument that is the one to reorder. Nothing
     #         should happen.
-    args = ["%s=test" % arg]
+    args = [arg_value]
     self.assertEqual(reorder(args, arg, has_arg=True), args)
 
     # Case 2) Again a single argument but this time not connected by '='
@@ -78,8 +79,8 @@ class TestArgv(TestCase):
     self.assertEqual(reorder(args, arg, has_arg=True), args)
 
     # Case 3) The argument intermixed with other ones.
-    args = ["--test1", "%s=test" % arg, "--test2"]
-    expected = ["--test1", "--test2", "%s=test" % arg]
+    args = ["--test1", arg_value, "--test2"]
+    expected = ["--test1", "--test2", arg_value]
     self.assertEqual(reorder(args, arg, has_arg=True), expected)
 
     # Case 4) The argument intermixed and also split in two again.
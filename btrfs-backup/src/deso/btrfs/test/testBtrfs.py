@@ -29,7 +29,6 @@ from deso.btrfs.command import (
   diff,
   serialize,
   snapshot,
-  sync,
 )
 from deso.btrfs.test.btrfsTest import (
   BtrfsDevice,
@@ -37,6 +36,7 @@ from deso.btrfs.test.btrfsTest import (
   BtrfsTestCase,
   make,
   Mount,
+  syncFileSystem,
 )
 from deso.execute import (
   execute,
@@ -54,22 +54,47 @@ from unittest import (
 
 class TestBtrfsDevice(TestCase):
   """A test case for btrfs loop device related functionality."""
+  @classmethod
+  def setUpClass(cls):
+    """Create a btrfs formatted loop back device and mount it.
+
+      Creating and formatting the device is by far the most expensive
+      part of the tests in here, so all of them share a single device.
+    """
+    super().setUpClass()
+
+    cls._btrfs = BtrfsDevice()
+    try:
+      cls._mount = Mount(cls._btrfs.device())
+    except:
+      cls._btrfs.destroy()
+      raise
+
+
+  @classmethod
+  def tearDownClass(cls):
+    """Unmount and destroy the btrfs device."""
+    cls._mount.destroy()
+    cls._btrfs.destroy()
+
+    super().tearDownClass()
+
+
   def testBtrfsDeviceCreation(self):
     """Verify that we can create a btrfs formatted loop back device."""
     def testReadWrite(name, string):
       """Open a file, write something into it and read it back."""
-      with open(mount.path(name), "w+") as handle:
+      with open(self._mount.path(name), "w+") as handle:
         handle.write(string)
         handle.seek(0)
         self.assertEqual(handle.read(), string)
 
-    with BtrfsDevice() as btrfs:
-      with Mount(btrfs.device()) as mount:
-        # We got the btrfs loop back device created and mounted
-        # somewhere. Try creating a file, writing something to it, and
-        # reading the data back to verify that everything actually
-        # works.
-        testReadWrite(mount.path("test.txt"), "testString98765")
+    # We got the btrfs loop back device created and mounted somewhere.
+    # Try creating files, writing something to them, and reading the
+    # data back to verify that everything actually works.
+    testReadWrite("test.txt", "testString98765")
+    testReadWrite("test2.txt", "")
+    testReadWrite("test3.txt", "testString" * 1024)
 
 
 class TestBtrfsSubvolume(BtrfsTestCase):
@@ -78,24 +103,39 @@ class TestBtrfsSubvolume(BtrfsTestCase):
     """Verify that we can create a btrfs subvolume."""
     # Create a subvolume and some files in it.
     with alias(self._mount) as m:
-      execute(*create(m.path("root")))
-      make(m, "root", "dir", "file", data=b"test")
+      root = m.path("root")
+      execute(*create(root))
+      file_ = make(m, "root", "dir", "file", data=b"test")
 
-      self.assertTrue(isdir(m.path("root")))
+      self.assertTrue(isdir(root))
       self.assertTrue(isdir(m.path("root", "dir")))
-      self.assertTrue(isfile(m.path("root", "dir", "file")))
+      self.assertTrue(isfile(file_))
 
 
   def testBtrfsSubvolumeDelete(self):
     """Verify that we can delete a btrfs subvolume."""
     with alias(self._mount) as m:
-      execute(*create(m.path("root")))
-      make(m, "root", "file", data=b"")
-      self.assertTrue(isfile(m.path("root", "file")))
-      execute(*delete(m.path("root")))
+      root = m.path("root")
+      execute(*create(root))
+      file_ = make(m, "root", "file", data=b"")
+      self.assertTrue(isfile(file_))
+      execute(*delete(root))
 
-      self.assertFalse(isdir(m.path("root")))
-      self.assertFalse(isfile(m.path("root", "file")))
+      self.assertFalse(isdir(root))
+      self.assertFalse(isfile(file_))
+
+
+  def testBtrfsSubvolumeDeleteMultiple(self):
+    """Verify that we can delete multiple btrfs subvolumes at once."""
+    with alias(self._mount) as m:
+      root1 = m.path("root1")
+      root2 = m.path("root2")
+      execute(*create(root1))
+      execute(*create(root2))
+      execute(*delete(root1, root2))
+
+      self.assertFalse(isdir(root1))
+      self.assertFalse(isdir(root2))
 
 
   def testBtrfsSnapshot(self):
@@ -111,15 +151,16 @@ class TestBtrfsSubvolume(BtrfsTestCase):
       data = b"test-string-to-read-from-snapshot"
       file_ = m.path("root_snapshot", "file")
 
-      execute(*create(m.path("root")))
+      root = m.path("root")
+
+      execute(*create(root))
       make(m, "root", "file", data=data)
 
-      execute(*snapshot(m.path("root"),
-                        m.path("root_snapshot")))
+      execute(*snapshot(root, m.path("root_snapshot")))
 
       # Verify that the snapshot file and the original have the same
       # content.
-      self.assertContains(file_, data.decode("utf-8"))
+      self.assertContains(file_, data)
 
 
 class TestBtrfsSnapshot(BtrfsSnapshotTestCase):
@@ -165,7 +206,7 @@ class TestBtrfsSnapshot(BtrfsSnapshotTestCase):
       make(m, "sent")
       # Make sure the snapshot is persisted to disk before serializing
       # it.
-      execute(*sync(m.path()))
+      syncFileSystem(m.path())
       pipeline([
         serialize(m.path("root_snapshot")),
         deserialize(m.path("sent"))
@@ -182,7 +223,7 @@ class TestBtrfsSnapshot(BtrfsSnapshotTestCase):
            alias(self._mount) as src:
         self.assertFalse(isdir(dst.path("root_snapshot")))
 
-        execute(*sync(src.path()))
+        syncFileSystem(src.path())
         # Send the snapshot to the newly created btrfs file system and
         # deserialize it in its / directory.
         pipeline([
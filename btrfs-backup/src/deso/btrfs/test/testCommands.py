@@ -66,28 +66,32 @@ class TestRepositoryBase(TestCase):
 
   def testReplaceFileStringInCommand(self):
     """Verify that the _replaceFileStringInCommand function works as expected."""
-    self.assertFalse(_replaceFileStringInCommand(["cat"], ["test"]), None)
-    self.assertFalse(_replaceFileStringInCommand(["cat", "-o"], ["test"]), None)
+    # Each case lists the command, the files to insert, and the expected
+    # command after the replacement or None if no replacement happens.
+    cases = [
+      (["cat"], ["test"], None),
+      (["cat", "-o"], ["test"], None),
+      (["cat", "{file}"], ["test"], ["cat", "test"]),
+      (
+        ["cat", "-o", "{file}", "-a", "test2"], ["test"],
+        ["cat", "-o", "test", "-a", "test2"],
+      ),
+      (
+        ["cat", "--a-long-option={file}", "-a", "test2"], ["test"],
+        ["cat", "--a-long-option=test", "-a", "test2"],
+      ),
+      (
+        ["cat", "--input={file}", "-a", "test3"], ["test1", "test2"],
+        ["cat", "--input=test1", "--input=test2", "-a", "test3"],
+      ),
+    ]
 
-    command = ["cat", "{file}"]
-    expected = ["cat", "test"]
-    self.assertTrue(_replaceFileStringInCommand(command, ["test"]))
-    self.assertEqual(command, expected)
-
-    command = ["cat", "-o", "{file}", "-a", "test2"]
-    expected = ["cat", "-o", "test", "-a", "test2"]
-    self.assertTrue(_replaceFileStringInCommand(command, ["test"]))
-    self.assertEqual(command, expected)
-
-    command = ["cat", "--a-long-option={file}", "-a", "test2"]
-    expected = ["cat", "--a-long-option=test", "-a", "test2"]
-    self.assertTrue(_replaceFileStringInCommand(command, ["test"]))
-    self.assertEqual(command, expected)
-
-    command = ["cat", "--input={file}", "-a", "test3"]
-    expected = ["cat", "--input=test1", "--input=test2", "-a", "test3"]
-    self.assertTrue(_replaceFileStringInCommand(command, ["test1", "test2"]))
-    self.assertEqual(command, expected)
+    for command, files, expected in cases:
+      original = command.copy()
+      result = _replaceFileStringInCommand(command, files)
+
+      self.assertEqual(result, expected is not None, original)
+      self.assertEqual(command, expected or original)
 
 
   def testReplaceFileStringInSpring(self):
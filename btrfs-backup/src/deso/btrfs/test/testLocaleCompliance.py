@@ -25,19 +25,13 @@ from deso.btrfs.repository import (
 from datetime import (
   datetime,
 )
-from functools import (
-  cmp_to_key,
-)
 from locale import (
   Error,
   LC_COLLATE,
   getlocale,
   locale_alias,
   setlocale,
-  strcoll,
-)
-from random import (
-  shuffle,
+  strxfrm,
 )
 from unittest import (
   TestCase,
@@ -45,49 +39,72 @@ from unittest import (
 )
 
 
+# All locales known to Python, without duplicates and in a stable order.
+_LOCALES = tuple(sorted(set(locale_alias.values())))
+
+
 class TestLocaleCompliance(TestCase):
   """Test compliance with various locales."""
   def testSortability(self):
     """Verify that sorting with our time stamp format works independently of the locale."""
+    datetimes = [
+      datetime(1970, 1,  1,  0,  0,  0),
+      datetime(1970, 2,  1,  0,  0,  0),
+      datetime(1988, 10, 13, 14, 33, 37),
+      datetime(1995, 12, 31, 23, 59, 59),
+      datetime(2000, 1,  1,  0,  0,  0),
+      datetime(2014, 2,  28, 17, 1,  48),
+      datetime(2015, 1,  4,  9,  34, 20),
+    ]
+    expected = [
+      "1970-01-01_00:00:00",
+      "1970-02-01_00:00:00",
+      "1988-10-13_14:33:37",
+      "1995-12-31_23:59:59",
+      "2000-01-01_00:00:00",
+      "2014-02-28_17:01:48",
+      "2015-01-04_09:34:20",
+    ]
+    # Only the collation differs between the locales we test, so the
+    # time stamps themselves need to be formatted only once.
+    formatted = [datetime.strftime(d, _TIME_FORMAT) for d in datetimes]
+    self.assertEqual(formatted, expected)
+
     def testSort():
       """Perform the sort test with the current locale."""
-      datetimes = [
-        datetime(1970, 1,  1,  0,  0,  0),
-        datetime(1970, 2,  1,  0,  0,  0),
-        datetime(1988, 10, 13, 14, 33, 37),
-        datetime(1995, 12, 31, 23, 59, 59),
-        datetime(2000, 1,  1,  0,  0,  0),
-        datetime(2014, 2,  28, 17, 1,  48),
-        datetime(2015, 1,  4,  9,  34, 20),
-      ]
-      expected = [
-        "1970-01-01_00:00:00",
-        "1970-02-01_00:00:00",
-        "1988-10-13_14:33:37",
-        "1995-12-31_23:59:59",
-        "2000-01-01_00:00:00",
-        "2014-02-28_17:01:48",
-        "2015-01-04_09:34:20",
-      ]
-      timestamps = [datetime.strftime(d, _TIME_FORMAT) for d in datetimes]
-      shuffle(timestamps)
-      timestamps.sort(key=cmp_to_key(strcoll))
-      self.assertEqual(timestamps, expected)
+      # The time stamps are listed in ascending order. Sorting them
+      # yields this very order exactly if their collation keys are
+      # strictly increasing, so it suffices to compare each key with its
+      # successor instead of actually sorting a shuffled list.
+      keys = [strxfrm(x) for x in formatted]
+      for key, next_ in zip(keys, keys[1:]):
+        self.assertLess(key, next_)
 
     previous = getlocale(LC_COLLATE)
-    locales = set(locale_alias.values())
+
+    # Many locales differ only in their encoding but share the collation
+    # rules for the characters our time stamps consist of. We test each
+    # language and territory combination only once, with the first of
+    # its encodings the system supports.
+    tested = set()
 
     # We have a list of all (Python-) known locales, a lot of which will
     # not be supported by the underlying operating system. We can only
     # do a best effort approach here and try our sorting with locales
     # that actually are supported.
-    for locale in locales:
+    for locale in _LOCALES:
+      stem = locale.split(".")[0]
+      if stem in tested:
+        continue
+
       try:
         setlocale(LC_COLLATE, locale)
-        testSort()
       except Error:
         # Ignore unsupported locales.
-        pass
+        continue
+
+      tested.add(stem)
+      testSort()
 
     setlocale(LC_COLLATE, previous)
 
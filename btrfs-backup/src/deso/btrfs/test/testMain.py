@@ -34,11 +34,13 @@ from deso.btrfs.command import (
 )
 from deso.btrfs.main import (
   duration,
+  jobs,
   main as btrfsMain,
 )
 from deso.btrfs.test.btrfsTest import (
   BtrfsDevice,
-  BtrfsTestCase,
+  BtrfsSharedTestCase,
+  Directory,
   make,
   Mount,
 )
@@ -58,6 +60,7 @@ from deso.execute import (
 )
 from os import (
   environ,
+  listdir,
   rmdir,
 )
 from os.path import (
@@ -67,6 +70,9 @@ from os.path import (
 from glob import (
   glob,
 )
+from io import (
+  StringIO,
+)
 from sys import (
   argv,
   executable,
@@ -81,6 +87,24 @@ from unittest.mock import (
 )
 
 
+def runMain(*args):
+  """Run the program's main function in-process and capture its output.
+
+    The function returns the program's exit code along with everything
+    it wrote to stdout and stderr. Running in-process spares us from
+    starting a new interpreter for tests that merely check argument
+    handling.
+  """
+  with patch("sys.stdout", new_callable=StringIO) as stdout,\
+       patch("sys.stderr", new_callable=StringIO) as stderr:
+    try:
+      code = btrfsMain([argv[0]] + list(args))
+    except SystemExit as e:
+      code = e.code
+
+  return code, stdout.getvalue(), stderr.getvalue()
+
+
 class TestMainOptions(TestCase):
   """Test case for option handling in the main program."""
   def testDurationParsingSuccess(self):
@@ -103,6 +127,22 @@ class TestMainOptions(TestCase):
         duration(fail)
 
 
+  def testJobsParsing(self):
+    """Test parsing of job counts."""
+    self.assertEqual(jobs("1"), 1)
+    self.assertEqual(jobs("16"), 16)
+
+    with self.assertRaisesRegex(ArgumentTypeError, "Invalid job count: \"0\""):
+      jobs("0")
+
+    with self.assertRaisesRegex(ArgumentTypeError, "Invalid job count: \"-3\""):
+      jobs("-3")
+
+    for fail in ["", "-1", "x", "2.5"]:
+      with self.assertRaises(ArgumentTypeError):
+        jobs(fail)
+
+
   def testInvokeNoArguments(self):
     """Verify the intended output is printed when the program is run without arguments."""
     regex = "the following arguments are required"
@@ -112,44 +152,31 @@ class TestMainOptions(TestCase):
 
   def testUsage(self):
     """Verify that the help contains an uppercase 'Usage:' string."""
-    def runMain(*args):
-      """Run the program and read the output it produces."""
-      stdout, _ = execute(executable, "-m", "deso.btrfs.main", *args, stdout=b"")
-      stdout = stdout.decode("utf-8")
-      return stdout
-
-    stdout = runMain("--help")
-    self.assertRegex(stdout, "^Usage:")
+    _, stdout, _ = runMain("--help")
+    self.assertTrue(stdout.startswith("Usage:"), stdout)
 
-    stdout = runMain("backup", "--help")
-    self.assertRegex(stdout, "^Usage:")
+    _, stdout, _ = runMain("backup", "--help")
+    self.assertTrue(stdout.startswith("Usage:"), stdout)
 
-    stdout = runMain("restore", "--help")
-    self.assertRegex(stdout, "^Usage:")
+    _, stdout, _ = runMain("restore", "--help")
+    self.assertTrue(stdout.startswith("Usage:"), stdout)
 
 
   def testUsageError(self):
     """Verify that the help contains an uppercase 'Usage:' string in case of wrong usage."""
-    def runMain(*args):
-      """Run the program."""
-      execute(executable, "-m", "deso.btrfs.main", *args)
-
     def runAndTest(*args):
       """Run the program with the given arguments and verify there is only one Usage: string."""
-      try:
-        runMain(*args)
-        # The command should fail due to missing arguments.
-        self.assertFalse(True)
-      except ProcessError as e:
-        string = str(e)
-
-      self.assertRegex(string, "Usage:")
-      self.assertNotRegex(string, "usage:")
+      code, _, string = runMain(*args)
+      # The command should fail due to missing arguments.
+      self.assertNotEqual(code, 0)
+
+      self.assertIn("Usage:", string)
+      self.assertNotIn("usage:", string)
       # Remove the usage string. There should not be a second one (we
       # had a couple of problems with two usage strings being prepended
       # to the actual line of text, hence this test).
       string = string.replace("Usage", "", 1)
-      self.assertNotRegex(string, "Usage:")
+      self.assertNotIn("Usage:", string)
 
     runAndTest()
     runAndTest("backup")
@@ -159,33 +186,33 @@ class TestMainOptions(TestCase):
   def testDebugOption(self):
     """Verify that using the --debug option an exception leaves the main function."""
     with TemporaryDirectory() as path:
-      args_base = "backup --subvolume {e} {e} {e} {d}"
-      args = args_base.format(e=join(path, "not-existant"), d="")
-      result = btrfsMain([argv[0]] + args.split())
+      e = join(path, "not-existant")
+      args = ["backup", "--subvolume", e, e, e]
+      result = btrfsMain([argv[0]] + args)
       self.assertNotEqual(result, 0)
 
-      args = args_base.format(e=join(path, "not-existant"), d="--debug")
       with self.assertRaises(FileNotFoundError):
-        btrfsMain([argv[0]] + args.split())
+        btrfsMain([argv[0]] + args + ["--debug"])
 
 
   def testSnapshotExtOption(self):
     """Verify that the --snapshot-ext option works as expected."""
-    def runMain(*args):
-      """Run the program."""
-      execute(executable, "-m", "deso.btrfs.main", *args)
+    def runAndTest(regex, *args):
+      """Run the program and verify that it fails with the given error."""
+      code, _, stderr = runMain(*args)
+      self.assertNotEqual(code, 0)
+      self.assertRegex(stderr, regex)
 
     regex = r"Extension must not start"
-    with self.assertRaisesRegex(ProcessError, regex):
-      runMain("backup", "--snapshot-ext=%senc" % extsep)
+    runAndTest(regex, "backup", "--snapshot-ext=%senc" % extsep)
 
     regex = r"The last receive filter must contain"
-    with self.assertRaisesRegex(ProcessError, regex):
-      runMain("backup", "--snapshot-ext=gz", "--recv-filter", "/bin/gzip")
+    runAndTest(regex, "backup", "--snapshot-ext=gz",
+               "--recv-filter", "/bin/gzip")
 
     regex = r"The first send filter must contain"
-    with self.assertRaisesRegex(ProcessError, regex):
-      runMain("restore", "--snapshot-ext=gz", "--send-filter", "/bin/gzip")
+    runAndTest(regex, "restore", "--snapshot-ext=gz",
+               "--send-filter", "/bin/gzip")
 
     # TODO: We should likely add a test to verify that the {file}
     #       detection works in conjunction with springs and the --join
@@ -195,60 +222,54 @@ class TestMainOptions(TestCase):
     # snapshot-ext option but other arguments are missing so we still
     # bail out.
     regex = r"arguments are required"
-    with self.assertRaisesRegex(ProcessError, regex):
-      runMain("backup", "--snapshot-ext=gz", "--recv-filter=/bin/gzip",
-              "--recv-filter", "/bin/dd of={file}")
+    runAndTest(regex, "backup", "--snapshot-ext=gz",
+               "--recv-filter=/bin/gzip",
+               "--recv-filter", "/bin/dd of={file}")
 
     regex = r"arguments are required"
-    with self.assertRaisesRegex(ProcessError, regex):
-      runMain("restore", "--snapshot-ext=gz",
-              "--send-filter=/bin/dd if={file}",
-              "--send-filter", "/bin/gzip")
+    runAndTest(regex, "restore", "--snapshot-ext=gz",
+               "--send-filter=/bin/dd if={file}",
+               "--send-filter", "/bin/gzip")
 
 
-class TestMainMisc(BtrfsTestCase):
+class TestMainMisc(BtrfsSharedTestCase):
   """A test case for testing of the progam's main functionality."""
   def testKeepFor(self):
     """Verify that using the --keep-for option old snapshots get deleted."""
     with patch("deso.btrfs.repository.datetime", wraps=datetime) as mock_now:
       with alias(self._mount) as m:
-        make(m, "subvol", subvol=True)
-        make(m, "snapshots")
-        make(m, "backup")
+        subvol = make(m, "subvol", subvol=True)
+        snapshots = make(m, "snapshots")
+        backup = make(m, "backup")
 
         now = datetime.now()
         mock_now.now.return_value = now
 
-        args = "backup --subvolume {subvol} {src} {dst}"
-        args = args.format(subvol=m.path("subvol"),
-                           src=m.path("snapshots"),
-                           dst=m.path("backup"))
-        result = btrfsMain([argv[0]] + args.split())
+        args = [argv[0], "backup", "--subvolume", subvol, snapshots, backup]
+        result = btrfsMain(args)
         self.assertEqual(result, 0)
-        self.assertEqual(len(glob(m.path("snapshots", "*"))), 1)
+        self.assertEqual(len(listdir(snapshots)), 1)
 
         # We need a second snapshot, taken at a later time.
         mock_now.now.return_value = now + timedelta(minutes=1)
         make(m, "subvol", "file1", data=b"data")
 
-        result = btrfsMain([argv[0]] + args.split())
+        result = btrfsMain(args)
         self.assertEqual(result, 0)
-        self.assertEqual(len(glob(m.path("snapshots", "*"))), 2)
+        self.assertEqual(len(listdir(snapshots)), 2)
 
         # Now for the purging.
         mock_now.now.return_value = now + timedelta(hours=7, seconds=1)
 
         # With a keep duration of one day the snapshots must stay.
-        args1 = args + " --keep-for=1d"
-        result = btrfsMain([argv[0]] + args1.split())
+        result = btrfsMain(args + ["--keep-for=1d"])
         self.assertEqual(result, 0)
-        self.assertEqual(len(glob(m.path("snapshots", "*"))), 2)
+        self.assertEqual(len(listdir(snapshots)), 2)
 
         # With a duration of 7 hours one must go.
-        args1 = args + " --keep-for=7H"
-        result = btrfsMain([argv[0]] + args1.split())
+        result = btrfsMain(args + ["--keep-for=7H"])
         self.assertEqual(result, 0)
-        self.assertEqual(len(glob(m.path("snapshots", "*"))), 1)
+        self.assertEqual(len(listdir(snapshots)), 1)
 
 
   def testRemoteAndFilterCommands(self):
@@ -259,9 +280,18 @@ class TestMainMisc(BtrfsTestCase):
     recv_filt1 = "/bin/bzip2 --decompress --small"
     recv_filt2 = "/bin/gzip --decompress"
 
+    # The commands we look for, split into their arguments just like the
+    # program does it, so that they can be compared without joining the
+    # arguments of each command checked into a string.
+    prefixes = {
+      x: x.split() for x in (remote_cmd, send_filt1, send_filt2,
+                             recv_filt1, recv_filt2)
+    }
+
     def isCommand(command, cmd_string):
       """Check if a given command begins with the given string."""
-      return " ".join(command).startswith(cmd_string)
+      prefix = prefixes[cmd_string]
+      return command[:len(prefix)] == prefix
 
     def removeRemoteCommand(command):
       """Filter all remote command parts from a command (if any)."""
@@ -274,10 +304,8 @@ class TestMainMisc(BtrfsTestCase):
 
     def isNoFilterCommand(command):
       """Check if a command is a filter command."""
-      return not (isCommand(command, send_filt1) or\
-                  isCommand(command, send_filt2) or\
-                  isCommand(command, recv_filt1) or\
-                  isCommand(command, recv_filt2))
+      filters = (send_filt1, send_filt2, recv_filt1, recv_filt2)
+      return not any(isCommand(command, x) for x in filters)
 
     def filterCommands(commands):
       """Filter all remote and filter command parts from a command list (if any)."""
@@ -355,20 +383,21 @@ class TestMainMisc(BtrfsTestCase):
         make(m, "snapshots")
         make(m, "backup")
 
-        args = "backup --debug --no-read-stderr --subvolume {subvol} {src} {dst}"
-        args = args.format(subvol=m.path("subvol"),
-                           src=m.path("snapshots"),
-                           dst=m.path("backup"))
+        args = [
+          "backup", "--debug", "--no-read-stderr",
+          "--subvolume", m.path("subvol"),
+          m.path("snapshots"), m.path("backup"),
+        ]
 
         # When not using --no-read-stderr the time stamp would be
         # followed by an error string containing the program's stderr
         # output.
         regex = r"subvol-2015-01-29_20:59:00$"
         with self.assertRaisesRegex(ProcessError, regex):
-          btrfsMain([argv[0]] + args.split())
+          btrfsMain([argv[0]] + args)
 
 
-class TestMainRunBase(BtrfsTestCase):
+class TestMainRunBase(BtrfsSharedTestCase):
   """Test case base class for btrfs-backup end-to-end tests."""
   def setUp(self):
     """Create the test harness with a single btrfs volume and some data."""
@@ -388,8 +417,9 @@ class TestMainRunBase(BtrfsTestCase):
     """Remove all subvolumes in a given path (non recursively)."""
     snapshots = glob(join(path, pattern))
 
-    for snapshot in snapshots:
-      execute(*delete(snapshot))
+    # A single btrfs invocation takes care of all subvolumes at once.
+    if snapshots:
+      execute(*delete(*snapshots))
 
     self.assertEqual(glob(join(path, pattern)), [])
 
@@ -430,10 +460,13 @@ class TestMainRunBase(BtrfsTestCase):
       # Case 2) Delete all created snapshots (really only the
       #         snapshots for now) from our "source" and try
       #         restoring them from the backup.
-      self.wipeSubvolumes(self._snapshots)
+      snapshots = self._snapshots
+      self.wipeSubvolumes(snapshots)
 
       restore(dst, src, "--snapshots-only")
-      user, root = glob(m.path("snapshots", "*"))
+      # Snapshot names start with the encoded path of their subvolume,
+      # so sorting them puts the one of the user's home first.
+      user, root = sorted(join(snapshots, x) for x in listdir(snapshots))
 
       self.assertContains(m.path(user, "data", "movie.mp4"), "abcdefgh")
       self.assertContains(m.path(root, ".ssh", "key.pub"), "1234567890")
@@ -442,41 +475,49 @@ class TestMainRunBase(BtrfsTestCase):
       #         and verify that they can be restored as well.
       self.wipeSubvolumes(m.path("home"))
       self.wipeSubvolumes(m.path(), pattern="root")
-      self.wipeSubvolumes(m.path("snapshots"))
+      self.wipeSubvolumes(snapshots)
 
       restore(dst, src)
 
-      user, = glob(m.path("home", "user"))
-      root, = glob(m.path("root"))
-
-      self.assertContains(m.path(user, "data", "movie.mp4"), "abcdefgh")
-      self.assertContains(m.path(root, ".ssh", "key.pub"), "1234567890")
+      # The subvolumes are restored to their original location, there is
+      # no need to search for them.
+      self.assertContains(m.path(self._user, "data", "movie.mp4"), "abcdefgh")
+      self.assertContains(m.path(self._root, ".ssh", "key.pub"), "1234567890")
 
 
 class TestLocalMainRun(TestMainRunBase):
   """Test case invoking the btrfs-progam for end-to-end tests with a local backup repository."""
-  def setUp(self):
-    """Create a btrfs device for the backups."""
+  @classmethod
+  def setUpClass(cls):
+    """Create a btrfs device for the backups of all tests."""
     with defer() as d:
-      super().setUp()
-      d.defer(super().tearDown)
-
-      self._bdevice = BtrfsDevice()
-      d.defer(self._bdevice.destroy)
+      super().setUpClass()
+      d.defer(super().tearDownClass)
 
-      self._backup = Mount(self._bdevice.device())
-      d.defer(self._backup.destroy)
+      cls._bdevice = BtrfsDevice()
+      d.defer(cls._bdevice.destroy)
 
-      self._backups = make(self._backup, "backup")
+      cls._backup_mount = Mount(cls._bdevice.device())
       d.release()
 
 
-  def tearDown(self):
+  @classmethod
+  def tearDownClass(cls):
     """Unmount the backup device and destroy it."""
-    self._backup.destroy()
-    self._bdevice.destroy()
+    cls._backup_mount.destroy()
+    cls._bdevice.destroy()
+
+    super().tearDownClass()
+
+
+  def setUp(self):
+    """Create the directory on the backup device the test works in."""
+    super().setUp()
 
-    super().tearDown()
+    # Just as for the source device, each test gets a separate
+    # directory on the shared backup device.
+    self._backup = Directory(self._backup_mount.path(self._testMethodName))
+    self._backups = make(self._backup, "backup")
 
 
   def testNormalRun(self):
@@ -520,17 +561,17 @@ class TestLocalMainRun(TestMainRunBase):
     except FileNotFoundError:
       raise SkipTest("GnuPG not found")
 
-    from deso.btrfs.test.gpg import PRIVATE_KEY, PUBLIC_KEY
+    from deso.btrfs.test.gpg import dearmor, PRIVATE_KEY, PUBLIC_KEY
 
     with NamedTemporaryFile() as public_key,\
          NamedTemporaryFile() as private_key:
       # First we need to convert our ASCII keys into binary ones (which
-      # reside in a file) for later usage. GnuPG can do that for us.
-      stdin = PUBLIC_KEY.encode("utf-8")
-      execute(GPG, "--dearmor", stdin=stdin, stdout=public_key.fileno())
+      # reside in a file) for later usage.
+      public_key.write(dearmor(PUBLIC_KEY))
+      public_key.flush()
 
-      stdin = PRIVATE_KEY.encode("utf-8")
-      execute(GPG, "--dearmor", stdin=stdin, stdout=private_key.fileno())
+      private_key.write(dearmor(PRIVATE_KEY))
+      private_key.flush()
 
       # Invoke the test but have it run with the functions using GPG.
       self.performTest(backup, restore, self._snapshots, self._backups)
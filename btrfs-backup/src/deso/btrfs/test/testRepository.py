@@ -19,6 +19,9 @@
 
 """Test the repository functionality."""
 
+from copy import (
+  deepcopy,
+)
 from datetime import (
   datetime,
   timedelta,
@@ -32,7 +35,6 @@ from deso.btrfs.command import (
   deserialize,
   serialize,
   snapshot,
-  sync,
 )
 from deso.btrfs.repository import (
   FileRepository,
@@ -42,11 +44,20 @@ from deso.btrfs.repository import (
   _encodePath,
   _findCommonSnapshots,
   _findRoot,
+  _parseList,
+  _parseTimestamp,
+  _purge,
   _relativize,
+  _snapshotBaseName,
   _snapshots,
+  _snapshotsNative,
+  SubvolumeIterator,
   sync as syncRepos,
+  _syncJobs,
+  _TIME_FORMAT,
   _trail,
   _untrail,
+  _versionKey,
 )
 from deso.btrfs.test.btrfsTest import (
   BtrfsDevice,
@@ -55,6 +66,7 @@ from deso.btrfs.test.btrfsTest import (
   BtrfsTestCase,
   make,
   Mount,
+  syncFileSystem,
 )
 from deso.cleanup import (
   defer,
@@ -79,8 +91,11 @@ from os.path import (
 )
 from unittest import (
   main,
+  SkipTest,
 )
 from unittest.mock import (
+  call,
+  Mock,
   patch,
 )
 
@@ -133,6 +148,154 @@ class TestRepositoryBase(BtrfsTestCase):
     doTest("/ho@@@@me/user", "@ho@@@@@@@@me@user@")
     doTest("/ho@@@@@me/user", "@ho@@@@@@@@@@me@user@")
     doTest("/this@is@a@long@path@", "@this@@is@@a@@long@@path@@@")
+    doTest("/ho{me}/us{}er", "@ho{me}@us{}er@")
+
+
+  def testParseList(self):
+    """Verify that the output of the snapshot list command is parsed correctly."""
+    output = "ID 257 gen 8 top level 5 path root_snapshot\n"\
+             "ID 261 gen 12 top level 5 path dir/snap shot\n"\
+             "ID 262 gen 13 top level 5 path d\u00efr/sn\u00e4pshot\n"
+    expected = [
+      {"gen": 8, "path": "root_snapshot"},
+      {"gen": 12, "path": "dir/snap shot"},
+      {"gen": 13, "path": "d\u00efr/sn\u00e4pshot"},
+    ]
+    # The command's output is parsed in its raw byte form.
+    output = output.encode("utf-8")
+    self.assertEqual(_parseList(output), expected)
+    self.assertEqual(_parseList(output.rstrip()), expected)
+
+    # Paths that are not valid UTF-8 must be preserved.
+    output = b"ID 263 gen 14 top level 5 path d\xbbr/snapshot\n"
+    expected = [{"gen": 14, "path": "d\udcbbr/snapshot"}]
+    self.assertEqual(_parseList(output), expected)
+
+    # Lines not adhering to the expected format must be reported, even
+    # if they are followed by valid ones.
+    output = "ID 257 gen 8 top level 5 path root_snapshot\n"\
+             "invalid line\n"\
+             "ID 261 gen 12 top level 5 path snapshot\n"
+    regex = r"unable to match line \"invalid line\""
+    with self.assertRaisesRegex(ValueError, regex):
+      _parseList(output.encode("utf-8"))
+
+
+  def testParseTimestamp(self):
+    """Verify that snapshot time stamps are parsed correctly."""
+    timestamps = [
+      datetime(1970, 1,  1,  0,  0,  0),
+      datetime(2015, 1,  29, 20, 59, 1),
+      datetime(2016, 2,  29, 23, 59, 59),
+    ]
+    for timestamp in timestamps:
+      string = datetime.strftime(timestamp, _TIME_FORMAT)
+      self.assertEqual(_parseTimestamp(string), timestamp)
+
+    with self.assertRaises(ValueError):
+      _parseTimestamp("2015-02-29_12:00:00")
+
+
+  def testVersionKey(self):
+    """Verify that numbers are sorted by value when using _versionKey()."""
+    name = "localhost-linux-x86_64-local-2015-01-09_15:39:47"
+    expected = [
+      "localhost-linux-x86_64-local-2015-01-09_09:12:01",
+      name,
+      "%s-2" % name,
+      "%s-10" % name,
+    ]
+    names = [expected[3], expected[1], expected[0], expected[2]]
+    self.assertEqual(sorted(names, key=_versionKey), expected)
+
+
+  def testPurgeSubvolumesWithCommonPrefix(self):
+    """Verify that purging ignores snapshots of subvolumes sharing a name prefix."""
+    home = _snapshotBaseName("/backup/home")
+    user = _snapshotBaseName("/backup/home-user")
+    # The snapshots as sorted by path, with those of the second
+    # subvolume listed after those of the first one.
+    names = [
+      home + "2015-01-01_00:00:00",
+      home + "2015-01-02_00:00:00",
+      home + "2015-01-02_00:00:00-1",
+      user + "2015-01-01_00:00:00",
+      user + "2015-01-03_00:00:00",
+    ]
+    snapshots = [{"path": x, "abspath": join("/snapshots", x)} for x in names]
+
+    repository = Mock()
+    repository.command.side_effect = lambda f, *a, **k: f(*a, **k)
+    repository.stderr = None
+
+    with patch("deso.btrfs.repository.execute") as mock_execute:
+      _purge("/backup/home", repository, timedelta(days=1), snapshots)
+
+    # The most recent snapshot of the subvolume must be kept, even
+    # though snapshots of the other subvolume follow it.
+    paths = [join("/snapshots", x) for x in names[:2]]
+    self.assertEqual(mock_execute.call_args_list,
+                     [call(*delete(*paths), stderr=None)])
+
+    with patch("deso.btrfs.repository.execute") as mock_execute:
+      _purge("/backup/home-user", repository, timedelta(days=1), snapshots)
+
+    paths = [join("/snapshots", names[3])]
+    self.assertEqual(mock_execute.call_args_list,
+                     [call(*delete(*paths), stderr=None)])
+
+    # Snapshots of the subvolume without a time stamp are still an error.
+    snapshots.insert(0, {"path": home + "foo", "abspath": "/snapshots/foo"})
+    with patch("deso.btrfs.repository.execute"):
+      with self.assertRaisesRegex(ValueError, "does not contain a time stamp"):
+        _purge("/backup/home", repository, timedelta(days=1), snapshots)
+
+
+  def testSyncJobs(self):
+    """Verify that the number of concurrent sync jobs is bounded correctly."""
+    self.assertEqual(_syncJobs(0, 1), 1)
+    self.assertEqual(_syncJobs(0, 4), 1)
+    self.assertEqual(_syncJobs(3, 1), 1)
+    self.assertEqual(_syncJobs(3, 2), 2)
+    self.assertEqual(_syncJobs(3, 4), 3)
+
+
+  def testSyncReportsFirstError(self):
+    """Verify that the error of the first failing subvolume is reported."""
+    def syncSubvolume(subvolume, src, dst):
+      """Fail the sync of all but the first subvolume."""
+      if subvolume != "/backup/a":
+        raise ValueError(subvolume)
+
+    subvolumes = ["/backup/a", "/backup/b", "/backup/c"]
+    for jobs in (1, 3):
+      with patch("deso.btrfs.repository._sync", side_effect=syncSubvolume) as mock_sync:
+        with self.assertRaisesRegex(ValueError, "^/backup/b$"):
+          syncRepos(subvolumes, None, None, jobs)
+
+      if jobs == 1:
+        # When syncing serially no subvolume is synced after a failure.
+        self.assertEqual(mock_sync.call_args_list,
+                         [call(x, None, None) for x in subvolumes[:2]])
+
+
+  def testFileRepositoryPipelineKeepsFilters(self):
+    """Verify that creating pipelines does not modify a repository's filters."""
+    filters = [
+      [["/bin/dd", "if={file}"], ["/bin/cat"]],
+      ["/bin/gzip", "--stdout", "{file}"],
+    ]
+    expected = deepcopy(filters)
+    repo = FileRepository("/tmp", ".gz", filters)
+
+    for _ in range(2):
+      src_cmds = repo.sendPipeline("snapshot", ["/tmp/parent"])
+      dst_cmds = repo.recvPipeline("snapshot")
+
+      self.assertEqual(src_cmds[0][0], ["/bin/dd", "if=/tmp/parent.gz"])
+      self.assertEqual(src_cmds[0][1], ["/bin/dd", "if=/tmp/snapshot.gz"])
+      self.assertEqual(dst_cmds[-1], ["/bin/gzip", "--stdout", "/tmp/snapshot.gz"])
+      self.assertEqual(filters, expected)
 
 
   def testFindRootCorrectDirectory(self):
@@ -305,7 +468,7 @@ class TestRepositoryBase(BtrfsTestCase):
       # Now we need a new snapshot.
       execute(*snapshot(m.path("root"),
                         m.path(name)))
-      execute(*sync(m.path()))
+      syncFileSystem(m.path())
 
     def transfer(snapshot, parent=None):
       """Transfer (serialize & deserialize) a snapshot into the 'sent' directory."""
@@ -385,6 +548,34 @@ class TestRepositorySnapshots(BtrfsSnapshotTestCase):
       self.assertEqual(snap2["path"], "root_snapshot4")
 
 
+  def testRepositoryListNativeMatchesCommand(self):
+    """Verify that listing snapshots via libbtrfsutil and btrfs(8) yields the same result."""
+    if SubvolumeIterator is None:
+      raise SkipTest("libbtrfsutil bindings not found")
+
+    with alias(self._mount) as m:
+      make(m, "repository")
+
+      execute(*snapshot(m.path("root"),
+                        m.path("repository", "root_snapshot3")))
+      execute(*snapshot(m.path("root"),
+                        m.path("repository", "root_snapshot10")))
+      # Writable snapshots and nested snapshots must not be listed.
+      execute(*snapshot(m.path("root"),
+                        m.path("repository", "root_writable"),
+                        writable=True))
+      execute(*snapshot(m.path("root"),
+                        m.path("repository", "root_writable", "nested")))
+
+      for directory in (m.path(), m.path("repository")):
+        repo = Repository(directory)
+        with patch("deso.btrfs.repository.SubvolumeIterator", None):
+          expected = _snapshots(repo)
+
+        self.assertNotEqual(expected, [])
+        self.assertEqual(_snapshotsNative(repo), expected)
+
+
 class TestRepository(BtrfsRepositoryTestCase):
   """Test repository functionality."""
   def testRepositoryListSnapshots(self):
@@ -464,6 +655,16 @@ class TestRepository(BtrfsRepositoryTestCase):
       self.assertFalse(r.changed("root_snapshot", r.path("root")))
 
 
+  def testRepositoryPurgeNothing(self):
+    """Verify that purging no subvolumes does not list any snapshots."""
+    with alias(self._repository) as r:
+      with patch.object(r, "snapshots") as mock_snapshots:
+        r.purge([], timedelta(seconds=0))
+
+      self.assertFalse(mock_snapshots.called)
+      self.assertEqual(len(r.snapshots()), 1)
+
+
 class TestBtrfsSync(BtrfsTestCase):
   """Test repository synchronization functionality."""
   def testRepositorySyncFailsForNonExistentSubvolume(self):
@@ -21,8 +21,15 @@
 
 from os import (
   environ,
+  getpid,
+  O_RDWR,
+  open as open_,
+)
+from os.path import (
+  isdir,
 )
 from tempfile import (
+  gettempdir,
   mkdtemp as mkdtemp_,
   mkstemp as mkstemp_,
   mktemp as mktemp_,
@@ -31,6 +38,19 @@ from tempfile import (
   TemporaryFile as TemporaryFile_,
 )
 
+try:
+  from os import (
+    O_TMPFILE,
+  )
+except ImportError:
+  # Python versions prior to 3.4 do not know about unnamed temporary
+  # files.
+  O_TMPFILE = None
+
+
+# A directory that is usually backed by memory.
+_SHM_DIR = "/dev/shm"
+
 
 def _getTestDir():
   """Retrieve the directory where to run tests in."""
@@ -50,6 +70,44 @@ def mkstemp(*args, **kwargs):
   return mkstemp_(*args, dir=_getTestDir(), **kwargs)
 
 
+def _getMemoryDir():
+  """Retrieve a directory for temporary files that is preferably memory backed.
+
+    The TEST_TMP_DIR environment variable still takes precedence.
+  """
+  directory = _getTestDir()
+  if directory is None and isdir(_SHM_DIR):
+    directory = _SHM_DIR
+
+  return directory
+
+
+def mkstempInMemory(*args, **kwargs):
+  """Wrapper around mkstemp that prefers a memory backed directory."""
+  return mkstemp_(*args, dir=_getMemoryDir(), **kwargs)
+
+
+def openUnnamedInMemory():
+  """Open an unnamed temporary file, preferably in a memory backed directory.
+
+    The file never has a name in the file system and vanishes once
+    closed. The function returns a file descriptor along with a path
+    through which the file can be opened for as long as the descriptor
+    is open, or None if unnamed files are not supported.
+  """
+  if O_TMPFILE is None:
+    return None
+
+  directory = _getMemoryDir()
+  try:
+    fd = open_(directory or gettempdir(), O_TMPFILE | O_RDWR, 0o600)
+  except OSError:
+    # The file system might not support unnamed temporary files.
+    return None
+
+  return fd, "/proc/%d/fd/%d" % (getpid(), fd)
+
+
 def NamedTemporaryFile(*args, **kwargs):
   """Wrapper around NamedTemporaryFile that honors the TEST_TMP_DIR environment variable."""
   return NamedTemporaryFile_(*args, dir=_getTestDir(), **kwargs)
@@ -58,9 +58,11 @@ from os import (
   close as close_,
   devnull,
   dup2,
+  environ,
   execv,
   execve,
   fork,
+  kill,
   open as open_,
   pipe2,
   read,
@@ -83,12 +85,25 @@ from select import (
   POLLPRI,
   poll,
 )
+from signal import (
+  SIGKILL,
+)
 from sys import (
   stderr as stderr_,
   stdin as stdin_,
   stdout as stdout_,
 )
 
+try:
+  from os import (
+    POSIX_SPAWN_DUP2,
+    posix_spawn,
+  )
+except ImportError:
+  # posix_spawn is only available starting with Python 3.8. We fall back
+  # to fork and exec in that case.
+  posix_spawn = None
+
 
 class ProcessError(ChildProcessError):
   """A class enhancing OSError with proper attributes for our use case.
@@ -194,50 +209,70 @@ def execute(*args, env=None, stdin=None, stdout=None, stderr=b""):
   return pipeline([list(args)], env, stdin, stdout, stderr)
 
 
+def _spawn(command, env, fd_in, fd_out, fd_err):
+  """Start a command with the given file descriptors as its stdin, stdout, and stderr."""
+  if posix_spawn is not None:
+    # Where available we let posix_spawn do the work. Unlike fork it does
+    # not have to duplicate our address space just to replace it right
+    # after. Errors to start the program are reported in this process.
+    actions = [
+      (POSIX_SPAWN_DUP2, fd_in, stdin_.fileno()),
+      (POSIX_SPAWN_DUP2, fd_out, stdout_.fileno()),
+      (POSIX_SPAWN_DUP2, fd_err, stderr_.fileno()),
+    ]
+    env = environ if env is None else env
+    return posix_spawn(command[0], list(command), env, file_actions=actions)
+
+  pid = fork()
+  if pid == 0:
+    dup2(fd_in, stdin_.fileno())
+    dup2(fd_out, stdout_.fileno())
+    dup2(fd_err, stderr_.fileno())
+
+    _exec(*command, env=env)
+    # This statement should never be reached: either exec fails in
+    # which case a Python exception should be raised or the program is
+    # started in which case this process' image is overwritten anyway.
+    # Keep it to be absolutely safe.
+    _exit(-1)
+
+  return pid
+
+
+def _kill(pids):
+  """Kill and reap all processes represented by a list of process IDs."""
+  for pid in pids:
+    # The process cannot vanish before we waited for it, so killing it
+    # always succeeds.
+    kill(pid, SIGKILL)
+    _waitpid(pid)
+
+
 def _pipeline(commands, env, fd_in, fd_out, fd_err):
   """Run a series of commands connected by their stdout/stdin."""
   pids = []
   first = True
 
-  for i, command in enumerate(commands):
-    last = i == len(commands) - 1
-
-    # If there are more commands upcoming then we need to set up a pipe.
-    if not last:
-      fd_in_new, fd_out_new = pipe2(O_CLOEXEC)
-
-    pids += [fork()]
-    child = pids[-1] == 0
-
-    if child:
-      if not first:
-        # Establish communication channel with previous process.
-        dup2(fd_in_old, stdin_.fileno())
-        close_(fd_in_old)
-        close_(fd_out_old)
-      else:
-        dup2(fd_in, stdin_.fileno())
+  try:
+    for i, command in enumerate(commands):
+      last = i == len(commands) - 1
 
+      # If there are more commands upcoming then we need to set up a
+      # pipe.
       if not last:
-        # Establish communication channel with next process.
-        close_(fd_in_new)
-        dup2(fd_out_new, stdout_.fileno())
-        close_(fd_out_new)
-      else:
-        dup2(fd_out, stdout_.fileno())
-
-      # Stderr is redirected for all commands in the pipeline because each
-      # process' output should be rerouted and stderr is not affected by
-      # the pipe between the processes in any way.
-      dup2(fd_err, stderr_.fileno())
-
-      _exec(*command, env=env)
-      # This statement should never be reached: either exec fails in
-      # which case a Python exception should be raised or the program is
-      # started in which case this process' image is overwritten anyway.
-      # Keep it to be absolutely safe.
-      _exit(-1)
-    else:
+        fd_in_new, fd_out_new = pipe2(O_CLOEXEC)
+
+      # Establish the communication channels with the previous and the
+      # next process, if any. Stderr is redirected for all commands in
+      # the pipeline because each process' output should be rerouted
+      # and stderr is not affected by the pipe between the processes in
+      # any way. All pipe file descriptors are opened with O_CLOEXEC, so
+      # the new process only ever sees the duplicated ones.
+      pids += [_spawn(command, env,
+                      fd_in if first else fd_in_old,
+                      fd_out if last else fd_out_new,
+                      fd_err)]
+
       if not first:
         close_(fd_in_old)
         close_(fd_out_old)
@@ -249,6 +284,12 @@ def _pipeline(commands, env, fd_in, fd_out, fd_err):
       if not last:
         fd_in_old = fd_in_new
         fd_out_old = fd_out_new
+  except:
+    # If a command could not be started the processes started so far
+    # may wait for input that never arrives. We must not leave them
+    # behind (or as zombies), so kill and reap them.
+    _kill(pids)
+    raise
 
   return pids
 
@@ -687,24 +728,17 @@ def _spring(commands, env, fds):
     fd_in_new = fd_in
     fd_out_new = fd_out
 
-  for i, command in enumerate(spring_cmds):
-    last = i == len(spring_cmds) - 1
-
-    pid = fork()
-    child = pid == 0
+  # The process of the spring command currently running, if it is not
+  # yet contained in 'pids'.
+  running = []
 
-    if child:
-      dup2(fd_in, stdin_.fileno())
-      dup2(fd_out_new, stdout_.fileno())
-      dup2(fd_err, stderr_.fileno())
+  try:
+    for i, command in enumerate(spring_cmds):
+      last = i == len(spring_cmds) - 1
 
-      if pipe_cmds:
-        close_(fd_in_new)
-        close_(fd_out_new)
+      pid = _spawn(command, env, fd_in, fd_out_new, fd_err)
+      running = [pid]
 
-      _exec(*command, env=env)
-      _exit(-1)
-    else:
       # After we started the first command from the spring we need to
       # make sure that there is a consumer of the output data. If there
       # were none, the new process could potentially block forever
@@ -726,11 +760,12 @@ def _spring(commands, env, fds):
 
       if not last:
         status = _waitpid(pid)
+        running = []
         if status != 0:
           # One command failed. Do not start any more commands and
-          # indicate failure to the caller. He may try reading data from
-          # stderr (if any and if reading from it is enabled) and will
-          # raise an exception.
+          # indicate failure to the caller. He may try reading data
+          # from stderr (if any and if reading from it is enabled) and
+          # will raise an exception.
           failed = formatCommands(command)
           break
       else:
@@ -742,10 +777,16 @@ def _spring(commands, env, fds):
         # processes the output of the spring) and we must keep this
         # order in the pid list.
         pids[-pipe_len:-pipe_len] = [pid]
-
-  if pipe_cmds:
-    close_(fd_in_new)
-    close_(fd_out_new)
+        running = []
+  except:
+    # Just as for a pipeline, do not leave behind any processes when a
+    # command could not be started.
+    _kill(running + pids)
+    raise
+  finally:
+    if pipe_cmds:
+      close_(fd_in_new)
+      close_(fd_out_new)
 
   assert poller
   return pids, poller, status, failed
@@ -32,7 +32,10 @@ from deso.execute.execute_ import (
 )
 from os import (
   environ,
+  fork,
   remove,
+  waitpid,
+  WNOHANG,
 )
 from os.path import (
   isfile,
@@ -67,6 +70,16 @@ from unittest import (
   TestCase,
   main,
 )
+from unittest.mock import (
+  patch,
+)
+
+try:
+  from os import (
+    posix_spawn,
+  )
+except ImportError:
+  posix_spawn = None
 
 
 _TRUE = findCommand("true")
@@ -76,6 +89,7 @@ _TOUCH = findCommand("touch")
 _CAT = findCommand("cat")
 _TR = findCommand("tr")
 _DD = findCommand("dd")
+_SLEEP = findCommand("sleep")
 
 
 def execute(*args, env=None, stdin=None, stdout=None, stderr=None):
@@ -454,6 +468,68 @@ class TestExecute(TestCase):
       doTest(i)
 
 
+  def testPipelineWithAndWithoutPosixSpawn(self):
+    """Verify that pipelines and springs work with posix_spawn and with fork."""
+    def doTest():
+      """Run a pipeline and a spring and check their output."""
+      commands = [[_ECHO, "test-abc"], [_TR, "a", "b"], [_TR, "-d", "-"]]
+      output, _ = pipeline(commands, stdout=b"")
+      self.assertEqual(output, b"testbbc\n")
+
+      commands = [[[_ECHO, "a"], [_ECHO, "c"]], [_TR, "a", "b"]]
+      output, _ = spring(commands, stdout=b"")
+      self.assertEqual(output, b"b\nc\n")
+
+    doTest()
+
+    with patch("deso.execute.execute_.posix_spawn", None):
+      doTest()
+
+
+  def testSpawnFailureReapsProcesses(self):
+    """Verify that processes are reaped if a later command cannot be started."""
+    def failAfter(function, count):
+      """Create a wrapper around 'function' failing once called 'count' times."""
+      calls = []
+
+      def wrapper(*args, **kwargs):
+        """Invoke the wrapped function or fail."""
+        if len(calls) == count:
+          raise OSError("Spawn failure")
+
+        calls.append(None)
+        return function(*args, **kwargs)
+
+      return wrapper
+
+    def doTest(name, function):
+      """Make the given start function fail and check for left over children."""
+      commands = [[_SLEEP, "60"], [_SLEEP, "60"], [_TR, "a", "b"]]
+      with patch(name, side_effect=failAfter(function, 2)):
+        with self.assertRaisesRegex(OSError, "Spawn failure"):
+          pipeline(commands)
+
+      commands = [
+        [[_ECHO, "a"], [_ECHO, "c"]],
+        [_SLEEP, "60"],
+        [_TR, "a", "b"],
+      ]
+      with patch(name, side_effect=failAfter(function, 2)):
+        with self.assertRaisesRegex(OSError, "Spawn failure"):
+          spring(commands)
+
+      # All started processes must have been killed and waited for
+      # already, i.e., there is neither a running child nor a zombie.
+      with self.assertRaises(ChildProcessError):
+        waitpid(-1, WNOHANG)
+
+    if posix_spawn is not None:
+      doTest("deso.execute.execute_.posix_spawn", posix_spawn)
+
+    with patch("deso.execute.execute_.posix_spawn", None):
+      doTest("deso.execute.execute_.fork", fork)
+
+
   def testPipelineErrorStatus(self):
     """Verify that the reported pipeline status is correct."""
     command = [executable, "-c", "exit(42)"]